@@ -28,5 +28,8 @@ import res_partner
 import sale
 import prestashop_osv
 import product_images
+import export_digest
+import sync_stats
+import order_state_outbox
 
 
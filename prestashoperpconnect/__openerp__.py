@@ -46,6 +46,8 @@ This module allows the synchronisation of the following objects between OpenERP
 
 Once these objects are synchronised, it will allow the import of orders, together with the related customers and addresses.
 
+By default, the stock export of a shop only pushes the quantities which changed since their last push to this shop (option "Export Changed Stock Only", also enabled on the existing shops when the module is updated). All the quantities are pushed again every 7 days (option "Full Stock Resync") or with the button "Resync All Stock Levels" of the shop.
+
 This connector uses the OpenERP modules base_sale_multichannels and base_external_referentials that bring a very sophisticated abstraction layer to build a reliable connector between OpenERP and another application. This connector requires the Prestapyt library that you can install via the command "easy_install prestapyt" (the source code of the library is managed on https://github.com/guewen/prestapyt). You also need the patch on OpenERP addons available here : https://bugs.launchpad.net/openobject-addons/+bug/930127
 
 This connector supports Prestashop 1.5 and uses the webservices of Prestashop ; it doesn't require any plug-in in Prestashop.
@@ -65,8 +67,13 @@ This connector is built on a very solid basis, but still requires deep knowledge
         'external_referential_view.xml',
         'sale_view.xml',
         'prestashoperpconnect_menu.xml',
+        'sync_stats_view.xml',
+        'sync_stats_data.xml',
+        'order_state_outbox_view.xml',
+        'order_state_outbox_data.xml',
         'board_prestashoperpconnect_view.xml',
         'res_partner_data.xml',
+        'sale_data.xml',
         'res_partner_view.xml',
         'settings/external.referential.type.csv',
         'settings/1.5.0.0/external.referential.version.csv',
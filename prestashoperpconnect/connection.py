@@ -0,0 +1,203 @@
+# -*- encoding: utf-8 -*-
+###############################################################################
+#                                                                             #
+#   Prestashoperpconnect for OpenERP                                          #
+#   Copyright (C) 2012 Akretion                                               #
+#                                                                             #
+#   This program is free software: you can redistribute it and/or modify      #
+#   it under the terms of the GNU Affero General Public License as            #
+#   published by the Free Software Foundation, either version 3 of the        #
+#   License, or (at your option) any later version.                           #
+#                                                                             #
+#   This program is distributed in the hope that it will be useful,           #
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of            #
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the             #
+#   GNU Affero General Public License for more details.                       #
+#                                                                             #
+#   You should have received a copy of the GNU Affero General Public License  #
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.     #
+#                                                                             #
+###############################################################################
+
+import base64
+import gzip
+import json
+import tempfile
+import threading
+import time
+import urllib2
+import httplib2
+from prestapyt import PrestaShopWebServiceDict, PrestaShopWebServiceError
+from prestapyt import xml2dict
+from instrumentation import get_resource_name, record_call
+try:
+    from xml.etree import cElementTree as ElementTree
+except ImportError:
+    from xml.etree import ElementTree
+
+# Number of seconds during which a connection which answered the
+# authentication probe is reused without probing it again
+CONNECTION_CHECK_TTL = 300
+
+# Size of the answers kept in memory by iter_resources, bigger answers are
+# written in a temporary file while they are read
+STREAM_SPOOL_SIZE = 1024 * 1024
+
+# {(dbname, referential_id): {'connection': ..., 'params': ..., 'checked_at': ...}}
+_connections = {}
+_connections_lock = threading.Lock()
+
+
+class PrestaShopWebServiceKeepAlive(PrestaShopWebServiceDict):
+    """PrestaShop webservice client which keeps one HTTP client per thread,
+    so the sockets are kept alive between the requests instead of opening
+    a new connection for each call"""
+
+    def __init__(self, *args, **kwargs):
+        super(PrestaShopWebServiceKeepAlive, self).__init__(*args, **kwargs)
+        self._local = threading.local()
+
+    def _get_http_client(self):
+        client = getattr(self._local, 'client', None)
+        if client is None:
+            client = httplib2.Http(**self.client_args)
+            # Prestashop use the key as username without password
+            client.add_credentials(self._api_key, False)
+            client.follow_all_redirects = True
+            self._local.client = client
+        return client
+
+    def _execute(self, url, method, body=None, add_headers=None):
+        """Same as PrestaShopWebService._execute but with the HTTP client
+        of the current thread"""
+        if add_headers is None:
+            add_headers = {}
+        if self.debug:
+            print "Execute url: %s / method: %s" % (url, method)
+        request_headers = self.headers.copy()
+        request_headers.update(add_headers)
+        resource = get_resource_name(self._api_url, url)
+        start = time.time()
+        content = ''
+        try:
+            header, content = self._get_http_client().request(url, method, body=body, headers=request_headers)
+            status_code = int(header['status'])
+            self._check_status_code(status_code, content)
+        except Exception:
+            record_call(resource, method, time.time() - start, len(body or ''), len(content or ''), error=True)
+            raise
+        record_call(resource, method, time.time() - start, len(body or ''), len(content or ''))
+        self._check_version(header.get('psws-version'))
+        if self.debug:
+            print ("Response code: %s\nResponse headers:\n%s\nResponse body:\n%s"
+                   % (status_code, header, content))
+        return status_code, header, content
+
+    def get_json(self, resource, resource_id=None, options=None):
+        """Same as get() but the webservice answers in JSON (output_format=JSON,
+        compressed with gzip) and the decoded JSON is returned"""
+        url = self._api_url + resource
+        if resource_id is not None:
+            url += "/%s" % (resource_id,)
+        querystring = 'output_format=JSON'
+        if options is not None:
+            self._validate(options)
+            querystring = "%s&%s" % (self._options_to_querystring(options), querystring)
+        url += "?%s" % (querystring,)
+        content = self._execute(url, 'GET', add_headers={'Accept-Encoding': 'gzip'})[2]
+        if not content:
+            raise PrestaShopWebServiceError('HTTP response is empty')
+        try:
+            return json.loads(content)
+        except ValueError, e:
+            raise PrestaShopWebServiceError('HTTP JSON response is not parsable : %s' % (e,))
+
+    def iter_resources(self, resource, options=None):
+        """Read a list of resources (use display=full in the options) and
+        yield each resource as a dict, like the ones returned by get().
+        The answer is copied in a spooled temporary file while it is
+        received and then parsed incrementally, so only one resource is
+        converted to a dict at a time"""
+        url = self._api_url + resource
+        if options is not None:
+            self._validate(options)
+            url += "?%s" % (self._options_to_querystring(options),)
+        if self.debug:
+            print "Execute url: %s / method: GET (stream)" % url
+        request = urllib2.Request(url, headers=self.headers)
+        request.add_header('Authorization', 'Basic %s' % base64.b64encode('%s:' % self._api_key))
+        request.add_header('Accept-Encoding', 'gzip')
+        resource_name = get_resource_name(self._api_url, url)
+        start = time.time()
+        try:
+            response = urllib2.urlopen(request)
+        except urllib2.HTTPError, e:
+            record_call(resource_name, 'GET', time.time() - start, error=True)
+            self._check_status_code(e.code, e.read())
+            raise PrestaShopWebServiceError('Unexpected answer of the webservice: %s' % e, e.code)
+        spool = tempfile.SpooledTemporaryFile(max_size=STREAM_SPOOL_SIZE)
+        try:
+            nr_bytes = 0
+            while True:
+                block = response.read(64 * 1024)
+                if not block:
+                    break
+                spool.write(block)
+                nr_bytes += len(block)
+            response.close()
+            record_call(resource_name, 'GET', time.time() - start, bytes_received=nr_bytes)
+            spool.seek(0)
+            content = spool
+            if response.info().get('Content-Encoding') == 'gzip':
+                content = gzip.GzipFile(fileobj=spool, mode='rb')
+            # <prestashop><orders><order>...</order>...</orders></prestashop>
+            depth = 0
+            container = None
+            for event, element in ElementTree.iterparse(content, events=('start', 'end')):
+                if event == 'start':
+                    depth += 1
+                    if depth == 2:
+                        container = element
+                    continue
+                depth -= 1
+                if depth == 2:
+                    yield xml2dict.ET2dict(element)[element.tag]
+                    # Free the resources already yielded
+                    container.clear()
+        finally:
+            spool.close()
+
+
+def get_connection(dbname, referential_id, location, apipass, debug=False):
+    """Return the connection of the referential and a boolean which is True
+    when the connection must be checked with an authentication probe.
+    The connection is rebuilt when the location, the password or the debug
+    mode of the referential change"""
+    key = (dbname, referential_id)
+    params = (location, apipass, debug)
+    with _connections_lock:
+        entry = _connections.get(key)
+        if not entry or entry['params'] != params:
+            entry = {
+                'connection': PrestaShopWebServiceKeepAlive('%s/api' % location, apipass, debug=debug),
+                'params': params,
+                'checked_at': None,
+            }
+            _connections[key] = entry
+        to_check = not entry['checked_at'] or time.time() - entry['checked_at'] > CONNECTION_CHECK_TTL
+    return entry['connection'], to_check
+
+
+def set_connection_checked(dbname, referential_id):
+    with _connections_lock:
+        entry = _connections.get((dbname, referential_id))
+        if entry:
+            entry['checked_at'] = time.time()
+    return True
+
+
+def invalidate_connection(dbname, referential_ids):
+    with _connections_lock:
+        for referential_id in referential_ids:
+            _connections.pop((dbname, referential_id), None)
+    return True
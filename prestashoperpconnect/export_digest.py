@@ -0,0 +1,78 @@
+# -*- encoding: utf-8 -*-
+###############################################################################
+#                                                                             #
+#   Prestashoperpconnect for OpenERP                                          #
+#   Copyright (C) 2012 Akretion                                               #
+#                                                                             #
+#   This program is free software: you can redistribute it and/or modify      #
+#   it under the terms of the GNU Affero General Public License as            #
+#   published by the Free Software Foundation, either version 3 of the        #
+#   License, or (at your option) any later version.                           #
+#                                                                             #
+#   This program is distributed in the hope that it will be useful,           #
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of            #
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the             #
+#   GNU Affero General Public License for more details.                       #
+#                                                                             #
+#   You should have received a copy of the GNU Affero General Public License  #
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.     #
+#                                                                             #
+###############################################################################
+
+from osv import osv, fields
+import hashlib
+import json
+
+
+def compute_digest(*values):
+    """Return the md5 digest of the given strings"""
+    digest = hashlib.md5()
+    for value in values:
+        if isinstance(value, unicode):
+            value = value.encode('utf-8')
+        digest.update(value or '')
+        digest.update('\0')
+    return digest.hexdigest()
+
+
+def compute_payload_digest(payload):
+    """Return the md5 digest of a resource sent to the webservice. The id
+    is ignored, so the payload of a creation matches the next updates"""
+    payload = dict([(key, value) for key, value in payload.items() if key != 'id'])
+    return compute_digest(json.dumps(payload, sort_keys=True, default=unicode))
+
+
+class prestashop_export_digest(osv.osv):
+    """Digest of the data last sent to PrestaShop for a record, used to
+    skip the requests when the data didn't change since the last export"""
+    _name = 'prestashop.export.digest'
+    _description = 'Digest of the data exported to PrestaShop'
+
+    _columns = {
+        'model': fields.char('Object', size=64, required=True, select=True),
+        'res_id': fields.integer('Record ID', required=True, select=True),
+        'referential_id': fields.many2one('external.referential', 'Referential', required=True, ondelete='cascade'),
+        'name': fields.char('Exported Data', size=32, required=True, help="Kind of exported data, ex: image"),
+        'digest': fields.char('Digest', size=64),
+    }
+
+    _sql_constraints = [
+        ('record_uniq', 'unique(model, res_id, referential_id, name)', 'The digest must be unique per record, referential and exported data!'),
+    ]
+
+    def get_digest(self, cr, uid, model, res_id, referential_id, name, context=None):
+        cr.execute("SELECT digest FROM prestashop_export_digest "
+                   "WHERE model = %s AND res_id = %s AND referential_id = %s AND name = %s",
+                   (model, res_id, referential_id, name))
+        res = cr.fetchone()
+        return res and res[0] or False
+
+    def set_digest(self, cr, uid, model, res_id, referential_id, name, digest, context=None):
+        cr.execute("UPDATE prestashop_export_digest SET digest = %s "
+                   "WHERE model = %s AND res_id = %s AND referential_id = %s AND name = %s",
+                   (digest, model, res_id, referential_id, name))
+        if not cr.rowcount:
+            cr.execute("INSERT INTO prestashop_export_digest (model, res_id, referential_id, name, digest) "
+                       "VALUES (%s, %s, %s, %s, %s)",
+                       (model, res_id, referential_id, name, digest))
+        return True
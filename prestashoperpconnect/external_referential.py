@@ -27,8 +27,10 @@ from osv import osv, fields
 from tools.translate import _
 from base_external_referentials.decorator import only_for_referential
 from base_external_referentials.external_osv import ExternalSession
-from prestapyt import PrestaShopWebServiceError, PrestaShopAuthenticationError, PrestaShopWebService, PrestaShopWebServiceDict
+from prestapyt import PrestaShopAuthenticationError
 from openerp.tools.config import config
+from connection import get_connection, set_connection_checked, invalidate_connection
+from mapping_cache import invalidate_mapping_lines
 
 from base_external_referentials.external_referentials import REF_VISIBLE_FIELDS
 REF_VISIBLE_FIELDS['Prestashop'] = ['location', 'apipass']
@@ -41,10 +43,46 @@ class external_referential(osv.osv):
         'last_customer_import_date': fields.datetime('Last Cust Imp', help="Last customer import date"),
         'last_customer_address_import_date': fields.datetime('Last Address Imp',
                                                         help="Last customer address import date"),
+        'last_customer_import_id': fields.integer('Resume Cust Imp After ID',
+                                                        help="Set when a customer import is interrupted, the next import starts after this PrestaShop ID"),
+        'last_customer_address_import_id': fields.integer('Resume Address Imp After ID',
+                                                        help="Set when a customer address import is interrupted, the next import starts after this PrestaShop ID"),
+        'last_customer_import_start': fields.datetime('Interrupted Cust Imp Start',
+                                                        help="Date of the beginning of the interrupted customer import, kept when it is resumed"),
+        'last_customer_address_import_start': fields.datetime('Interrupted Address Imp Start',
+                                                        help="Date of the beginning of the interrupted customer address import, kept when it is resumed"),
         'last_product_attributes_export_date' : fields.datetime('Last Product Attributes Export Time'),
         'active_language_ids': fields.many2many('res.lang', 'active_presta_lang', 'referential_id', 'lang_id', 'Active Languages'),
+        'read_by_page': fields.boolean('Read Resources by Page',
+                help="If checked, the imports read all the resources of a page with one request (display=full) instead of one request per resource"),
+        'stream_responses': fields.boolean('Stream Pages',
+                help="Only used when the resources are read by page. If checked, the answer of the webservice is parsed while it is read and the resources are recorded by small chunks, so the memory used doesn't depend on the size of the pages"),
+        'fetch_workers': fields.integer('Concurrent Requests',
+                help="Maximum number of requests sent at the same time to the webservice when reading resources. With 1, the resources are read one after the other"),
+        'fetch_rate_limit': fields.float('Max Requests per Second',
+                help="Maximum number of concurrent requests started per second on the webservice, 0 for no limit"),
+        'sync_job_ids': fields.one2many('prestashop.sync.job', 'referential_id', 'Synchronisation Jobs', readonly=True),
+        'output_format': fields.selection([('xml', 'XML'), ('json', 'JSON')], 'Output Format', required=True,
+                help="Format of the answers of the webservice when reading resources. JSON answers are smaller and faster to decode, "
+                     "they need PrestaShop 1.5 or later. The pages are only streamed in XML"),
     }
 
+    _defaults = {
+        'fetch_workers': 1,
+        'output_format': 'xml',
+    }
+
+    def _check_output_format(self, cr, uid, ids, context=None):
+        for referential in self.browse(cr, uid, ids, context=context):
+            if referential.output_format == 'json' and referential.version_id.type_id.code == 'prestashop' \
+                    and referential.version_id.code and referential.version_id.code < 'prestashop1500':
+                return False
+        return True
+
+    _constraints = [
+        (_check_output_format, 'The JSON output format needs PrestaShop 1.5 or later.', ['output_format', 'version_id']),
+    ]
+
     _lang_support = 'fields_with_no_lang'
 
     @only_for_referential('prestashop')
@@ -52,14 +90,29 @@ class external_referential(osv.osv):
         if isinstance(id, list):
             id = id[0]
         referential = self.browse(cr, uid, id, context=context)
-        prestashop = PrestaShopWebServiceDict('%s/api'%referential.location, referential.apipass, debug=referential.debug)
-        try:
-            prestashop.head('')
-        except PrestaShopAuthenticationError, e:
-            if config['debug_mode']: raise
-            raise osv.except_osv(_("Connection Error"), _("Could not connect to the PrestaShop webservice\nCheck the webservice URL and password\nHTTP error code: %s"%e.error_code))
+        prestashop, to_check = get_connection(cr.dbname, referential.id, referential.location, referential.apipass, debug=referential.debug)
+        if to_check:
+            try:
+                prestashop.head('')
+            except PrestaShopAuthenticationError, e:
+                if config['debug_mode']: raise
+                raise osv.except_osv(_("Connection Error"), _("Could not connect to the PrestaShop webservice\nCheck the webservice URL and password\nHTTP error code: %s"%e.error_code))
+            set_connection_checked(cr.dbname, referential.id)
         return prestashop
 
+    def write(self, cr, uid, ids, vals, context=None):
+        if isinstance(ids, (int, long)):
+            ids = [ids]
+        if 'location' in vals or 'apipass' in vals:
+            invalidate_connection(cr.dbname, ids)
+        return super(external_referential, self).write(cr, uid, ids, vals, context=context)
+
+    def unlink(self, cr, uid, ids, context=None):
+        if isinstance(ids, (int, long)):
+            ids = [ids]
+        invalidate_connection(cr.dbname, ids)
+        return super(external_referential, self).unlink(cr, uid, ids, context=context)
+
     def _compare_languages(self, cr, uid, ps_dict, oe_dict, ps_readable_field, obj_readable_name, oe_obj, external_session, context=None):
         if len(oe_dict['code']) >= 2 \
             and len(ps_dict[0]['language_code']) >=2 \
@@ -88,7 +141,7 @@ class external_referential(osv.osv):
             and oe_dict['code'].lower() == ps_dict[0]['iso_code'].lower():
 
             ps_country_id = int(ps_dict[0]['id_country'])
-            oe_country_id = self.pool.get('res.country').extid_to_existing_oeid(cr, uid, external_id=ps_country_id, referential_id=external_session.referential_id.id, context=context)
+            oe_country_id = self.pool.get('res.country').get_external_id_map(cr, uid, external_session, context=context).get_oeid(ps_country_id)
             if oe_country_id and oe_dict['country_id'][0] == oe_country_id:
                 external_session.logger.info(_("[%s] Mapping PS '%s' (%s) with PS country ID %s to OERP '%s' (%s) with country '%s' (ID %d)")
                     % (obj_readable_name, ps_dict[0][ps_readable_field],
@@ -119,7 +172,44 @@ class external_referential(osv.osv):
         else:
             return False
 
-    def _bidirectional_synchro(self, cr, uid, external_session, obj_readable_name, oe_obj, ps_field, ps_readable_field, compare_function, context=None):
+    def _language_keys(self, cr, uid, external_session, oe_dict=None, ps_dict=None, context=None):
+        code = oe_dict['code'] if oe_dict is not None else ps_dict[0]['language_code']
+        return code and len(code) >= 2 and [code[0:2].lower()] or []
+
+    def _country_keys(self, cr, uid, external_session, oe_dict=None, ps_dict=None, context=None):
+        code = oe_dict['code'] if oe_dict is not None else ps_dict[0]['iso_code']
+        return code and len(code) >= 2 and [code[0:2].lower()] or []
+
+    def _state_keys(self, cr, uid, external_session, oe_dict=None, ps_dict=None, context=None):
+        if oe_dict is not None:
+            if not oe_dict['code'] or not oe_dict['country_id']:
+                return []
+            return [(oe_dict['code'].lower(), oe_dict['country_id'][0])]
+        if not ps_dict[0]['iso_code']:
+            return []
+        country_map = self.pool.get('res.country').get_external_id_map(cr, uid, external_session, context=context)
+        return [(ps_dict[0]['iso_code'].lower(), country_map.get_oeid(ps_dict[0]['id_country']))]
+
+    def _currency_keys(self, cr, uid, external_session, oe_dict=None, ps_dict=None, context=None):
+        code = oe_dict['name'] if oe_dict is not None else ps_dict[0]['iso_code']
+        return code and len(code) == 3 and [code.lower()] or []
+
+    def _tax_keys(self, cr, uid, external_session, oe_dict=None, ps_dict=None, context=None):
+        # Taxes are indexed by their rate in hundredths of percent, the
+        # neighbour buckets are also searched as the rates may differ of 0.01
+        if oe_dict is not None:
+            if oe_dict['type_tax_use'] != 'sale':
+                return []
+            return [int(round(oe_dict['amount'] * 10000))]
+        rate = int(round(float(ps_dict[0]['rate']) * 100))
+        return [rate - 1, rate, rate + 1]
+
+    def _bidirectional_synchro(self, cr, uid, external_session, obj_readable_name, oe_obj, ps_field, ps_readable_field, compare_function, key_function=None, context=None):
+        """Map the PrestaShop resources with the existing OpenERP records.
+        When a key_function is given, the OpenERP records are indexed by the
+        keys it returns and compare_function is only called on the records
+        which have one of the keys of the PrestaShop resource
+        """
         external_session.logger.info(_("[%s] Starting synchro between OERP and PS") %obj_readable_name)
         referential_id = external_session.referential_id.id
         nr_ps_already_mapped = 0
@@ -128,42 +218,59 @@ class external_referential(osv.osv):
         # Get all OERP obj
         oe_ids = oe_obj.search(cr, uid, [], context=context)
         oe_list_dict = oe_obj.read(cr, uid, oe_ids, context=context)
-        #print "oe_list_dict=", oe_list_dict
+        oe_index = {}
+        if key_function:
+            for position, oe_dict in enumerate(oe_list_dict):
+                for key in key_function(cr, uid, external_session, oe_dict=oe_dict, context=context):
+                    oe_index.setdefault(key, []).append((position, oe_dict))
         # Get the IDS from PS
         ps_ids = oe_obj._get_external_resource_ids(cr, uid, external_session, context=context)
-        #print "ps_ids=", ps_ids
         if not ps_ids:
             raise osv.except_osv(_('Error :'), _('Failed to query %s via PS webservice')% obj_readable_name)
-        # Loop on all PS IDs
+        # Get the PS IDs already mapped with one query
+        id_map = oe_obj.get_external_id_map(cr, uid, external_session, context=context)
+        existing_oe_ids = set(oe_ids)
+        ps_ids_to_map = []
         for ps_id in ps_ids:
-            # Check if the PS ID is already mapped to an OE ID
-            oe_id = oe_obj.extid_to_existing_oeid(cr, uid, external_id=ps_id, referential_id=referential_id, context=context)
-            #print "oe_c_id=", oe_id
+            oe_id = id_map.get_oeid(ps_id)
+            if oe_id and oe_id not in existing_oe_ids:
+                # The record may be inactive or deleted, check it as before
+                oe_id = oe_obj.extid_to_existing_oeid(cr, uid, external_id=ps_id, referential_id=referential_id, context=context)
             if oe_id:
                 # Do nothing for the PS IDs that are already mapped
                 external_session.logger.debug(_("[%s] PS ID %s is already mapped to OERP ID %s") %(obj_readable_name, ps_id, oe_id))
                 nr_ps_already_mapped += 1
             else:
-                # PS IDs not mapped => I try to match between the PS ID and the OE ID
-                # I read field in PS
-                ps_dict = oe_obj._get_external_resources(cr, uid, external_session, ps_id, context=context)
-                #print "ps_dict=", ps_dict
-                mapping_found = False
-                # Loop on OE IDs
-                for oe_dict in oe_list_dict:
-                    # Search for a match
-                    if compare_function(cr, uid, ps_dict, oe_dict, ps_readable_field, obj_readable_name, oe_obj, external_session, context=context):
-                        # it matches, so I write the external ID
-                        oe_obj.create_external_id_vals(cr, uid, existing_rec_id=oe_dict['id'], external_id=ps_id, referential_id=referential_id, context=context)
-                        nr_ps_mapped += 1
-                        mapping_found = True
-                        break
-                if not mapping_found:
-                    # if it doesn't match, I just print a warning
-                    external_session.logger.warning(
-                        _("[%s] PS '%s' (%s) was not mapped to any OERP entry")
-                        % (obj_readable_name, ps_dict[0][ps_readable_field], ps_dict[0][ps_field]))
-                    nr_ps_not_mapped += 1
+                ps_ids_to_map.append(ps_id)
+        # PS IDs not mapped => I try to match between the PS ID and the OE ID
+        # I read all of them in PS with batched requests
+        ext_resource = oe_obj._get_prestashop_resource_name(cr, uid, external_session, context=context)
+        ps_dicts = oe_obj._get_external_resources_by_ids(cr, uid, external_session, ext_resource, ps_ids_to_map, context=context)
+        for ps_id in ps_ids_to_map:
+            ps_dict = ps_dicts.get(ps_id) or oe_obj._get_external_resources(cr, uid, external_session, ps_id, context=context)
+            if key_function:
+                candidates = []
+                for key in key_function(cr, uid, external_session, ps_dict=ps_dict, context=context):
+                    candidates += oe_index.get(key, [])
+                # Keep the order of the OERP records, the first one which matches wins
+                candidates = [oe_dict for position, oe_dict in sorted(candidates, key=lambda candidate: candidate[0])]
+            else:
+                candidates = oe_list_dict
+            mapping_found = False
+            for oe_dict in candidates:
+                # Search for a match
+                if compare_function(cr, uid, ps_dict, oe_dict, ps_readable_field, obj_readable_name, oe_obj, external_session, context=context):
+                    # it matches, so I write the external ID
+                    oe_obj.create_external_id_vals(cr, uid, existing_rec_id=oe_dict['id'], external_id=ps_id, referential_id=referential_id, context=context)
+                    nr_ps_mapped += 1
+                    mapping_found = True
+                    break
+            if not mapping_found:
+                # if it doesn't match, I just print a warning
+                external_session.logger.warning(
+                    _("[%s] PS '%s' (%s) was not mapped to any OERP entry")
+                    % (obj_readable_name, ps_dict[0][ps_readable_field], ps_dict[0][ps_field]))
+                nr_ps_not_mapped += 1
         external_session.logger.info(
             _("[%s] Synchro between OERP and PS successfull") %obj_readable_name)
         external_session.logger.info(_("[%s] Number of PS entries already mapped = %s")
@@ -210,27 +317,32 @@ class external_referential(osv.osv):
         self._bidirectional_synchro(cr, uid, external_session, obj_readable_name='LANG',
             oe_obj=self.pool.get('res.lang'),
             ps_field='language_code', ps_readable_field='name',
-            compare_function=self._compare_languages, context=context)
+            compare_function=self._compare_languages,
+            key_function=self._language_keys, context=context)
 
         self._bidirectional_synchro(cr, uid, external_session, obj_readable_name='COUNTRY',
             oe_obj=self.pool.get('res.country'),
             ps_field='iso_code', ps_readable_field='name',
-            compare_function=self._compare_countries, context=context)
+            compare_function=self._compare_countries,
+            key_function=self._country_keys, context=context)
 
         self._bidirectional_synchro(cr, uid, external_session, obj_readable_name='STATES',
             oe_obj=self.pool.get('res.country.state'),
             ps_field='iso_code', ps_readable_field='name',
-            compare_function=self._compare_states, context=context)
+            compare_function=self._compare_states,
+            key_function=self._state_keys, context=context)
 
         self._bidirectional_synchro(cr, uid, external_session, obj_readable_name='CURRENCY',
             oe_obj=self.pool.get('res.currency'),
             ps_field='iso_code', ps_readable_field='name',
-            compare_function=self._compare_currencies, context=context)
+            compare_function=self._compare_currencies,
+            key_function=self._currency_keys, context=context)
 
         self._bidirectional_synchro(cr, uid, external_session, obj_readable_name='TAXES',
             oe_obj=self.pool.get('account.tax'),
             ps_field='rate', ps_readable_field='name',
-            compare_function=self._compare_taxes, context=context)
+            compare_function=self._compare_taxes,
+            key_function=self._tax_keys, context=context)
 
         return True
 
@@ -263,6 +375,18 @@ class external_mapping(osv.osv):
         'prestashop_primary_key': fields.char('Prestashop primary key', size=128),
     }
 
+class external_mapping_line(osv.osv):
+    _inherit = 'external.mapping.line'
+
+    def write(self, cr, uid, ids, vals, context=None):
+        res = super(external_mapping_line, self).write(cr, uid, ids, vals, context=context)
+        invalidate_mapping_lines(cr.dbname, isinstance(ids, (int, long)) and [ids] or ids)
+        return res
+
+    def unlink(self, cr, uid, ids, context=None):
+        invalidate_mapping_lines(cr.dbname, isinstance(ids, (int, long)) and [ids] or ids)
+        return super(external_mapping_line, self).unlink(cr, uid, ids, context=context)
+
 class external_mapping_template(osv.osv):
     _inherit = 'external.mapping.template'
 
@@ -0,0 +1,148 @@
+# -*- encoding: utf-8 -*-
+###############################################################################
+#                                                                             #
+#   Prestashoperpconnect for OpenERP                                          #
+#   Copyright (C) 2012 Akretion                                               #
+#                                                                             #
+#   This program is free software: you can redistribute it and/or modify      #
+#   it under the terms of the GNU Affero General Public License as            #
+#   published by the Free Software Foundation, either version 3 of the        #
+#   License, or (at your option) any later version.                           #
+#                                                                             #
+#   This program is distributed in the hope that it will be useful,           #
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of            #
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the             #
+#   GNU Affero General Public License for more details.                       #
+#                                                                             #
+#   You should have received a copy of the GNU Affero General Public License  #
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.     #
+#                                                                             #
+###############################################################################
+
+import sys
+import threading
+import time
+import Queue
+from instrumentation import get_current_stats, set_current_stats
+
+# {(dbname, referential_id): RequestLimiter}
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+class RequestLimiter(object):
+    """Limit the number of requests running at the same time and the number
+    of requests started per second on one referential"""
+
+    def __init__(self, max_concurrency, max_rate):
+        self.max_concurrency = max(max_concurrency, 1)
+        self.max_rate = max_rate
+        self._semaphore = threading.BoundedSemaphore(self.max_concurrency)
+        self._rate_lock = threading.Lock()
+        self._next_start = 0.0
+
+    def _wait_rate(self):
+        if not self.max_rate:
+            return
+        with self._rate_lock:
+            now = time.time()
+            start = max(now, self._next_start)
+            self._next_start = start + 1.0 / self.max_rate
+        if start > now:
+            time.sleep(start - now)
+
+    def __enter__(self):
+        self._semaphore.acquire()
+        self._wait_rate()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._semaphore.release()
+        return False
+
+
+def get_limiter(dbname, referential_id, max_concurrency, max_rate):
+    """Return the limiter shared by all the synchronisations of a referential"""
+    key = (dbname, referential_id)
+    with _limiters_lock:
+        limiter = _limiters.get(key)
+        if not limiter or limiter.max_concurrency != max(max_concurrency, 1) \
+                or limiter.max_rate != max_rate:
+            limiter = RequestLimiter(max_concurrency, max_rate)
+            _limiters[key] = limiter
+    return limiter
+
+
+class FetchResult(object):
+    """Result of a call submitted to the ConcurrentFetcher"""
+
+    def __init__(self):
+        self._done = threading.Event()
+        self._value = None
+        self._exc_info = None
+
+    def set_value(self, value):
+        self._value = value
+        self._done.set()
+
+    def set_exception(self, exc_info):
+        self._exc_info = exc_info
+        self._done.set()
+
+    def get(self):
+        """Wait for the end of the call and return its result. If the call
+        raised an exception, it is raised again in the calling thread"""
+        self._done.wait()
+        if self._exc_info:
+            raise self._exc_info[0], self._exc_info[1], self._exc_info[2]
+        return self._value
+
+
+class ConcurrentFetcher(object):
+    """Run webservice calls in a pool of threads bounded by the limiter of
+    the referential. The threads stop as soon as there is nothing left to
+    fetch. The submitted functions must only use the webservice : the
+    database cursor stays on the thread of the synchronisation"""
+
+    def __init__(self, limiter):
+        self.limiter = limiter
+        self._queue = Queue.Queue()
+        self._lock = threading.Lock()
+        self._nr_workers = 0
+
+    def submit(self, func, *args, **kwargs):
+        result = FetchResult()
+        # The calls are counted in the job which submitted them
+        self._queue.put((result, get_current_stats(), func, args, kwargs))
+        with self._lock:
+            if self._nr_workers < self.limiter.max_concurrency:
+                self._nr_workers += 1
+                worker = threading.Thread(target=self._work)
+                worker.daemon = True
+                worker.start()
+        return result
+
+    def map(self, func, items):
+        """Submit func(item) for each item and return the list of FetchResult"""
+        return [self.submit(func, item) for item in items]
+
+    def _work(self):
+        while True:
+            try:
+                result, stats, func, args, kwargs = self._queue.get_nowait()
+            except Queue.Empty:
+                with self._lock:
+                    if self._queue.empty():
+                        self._nr_workers -= 1
+                        return
+                continue
+            set_current_stats(stats)
+            try:
+                with self.limiter:
+                    value = func(*args, **kwargs)
+            except Exception:
+                result.set_exception(sys.exc_info())
+            else:
+                result.set_value(value)
+            finally:
+                set_current_stats(None)
@@ -0,0 +1,83 @@
+# -*- encoding: utf-8 -*-
+###############################################################################
+#                                                                             #
+#   Prestashoperpconnect for OpenERP                                          #
+#   Copyright (C) 2012 Akretion                                               #
+#                                                                             #
+#   This program is free software: you can redistribute it and/or modify      #
+#   it under the terms of the GNU Affero General Public License as            #
+#   published by the Free Software Foundation, either version 3 of the        #
+#   License, or (at your option) any later version.                           #
+#                                                                             #
+#   This program is distributed in the hope that it will be useful,           #
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of            #
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the             #
+#   GNU Affero General Public License for more details.                       #
+#                                                                             #
+#   You should have received a copy of the GNU Affero General Public License  #
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.     #
+#                                                                             #
+###############################################################################
+
+import threading
+import weakref
+
+# {(dbname, model, referential_id): WeakSet of the loaded ExternalIdMap}
+_loaded_id_maps = {}
+_loaded_id_maps_lock = threading.Lock()
+
+
+def _normalize_extid(external_id):
+    if isinstance(external_id, basestring) and external_id.isdigit():
+        return int(external_id)
+    return external_id
+
+
+class ExternalIdMap(object):
+    """Map between the external ids and the OpenERP ids of one object on one
+    referential. It is loaded once and then kept up to date when external
+    ids are created or deleted, so lookups don't query ir_model_data"""
+
+    def __init__(self, dbname, model, referential_id, ext_to_oe):
+        self.key = (dbname, model, referential_id)
+        self.ext_to_oe = {}
+        self.oe_to_ext = {}
+        for external_id, oe_id in ext_to_oe.items():
+            self.add(oe_id, external_id)
+        with _loaded_id_maps_lock:
+            _loaded_id_maps.setdefault(self.key, weakref.WeakSet()).add(self)
+
+    def add(self, oe_id, external_id):
+        external_id = _normalize_extid(external_id)
+        self.ext_to_oe[external_id] = oe_id
+        self.oe_to_ext[oe_id] = external_id
+
+    def discard(self, external_id):
+        oe_id = self.ext_to_oe.pop(_normalize_extid(external_id), None)
+        if oe_id is not None:
+            self.oe_to_ext.pop(oe_id, None)
+
+    def get_oeid(self, external_id):
+        return self.ext_to_oe.get(_normalize_extid(external_id), False)
+
+    def get_extid(self, oe_id):
+        return self.oe_to_ext.get(oe_id, False)
+
+
+def _get_loaded_id_maps(dbname, model, referential_id):
+    with _loaded_id_maps_lock:
+        return list(_loaded_id_maps.get((dbname, model, referential_id), []))
+
+
+def add_to_id_maps(dbname, model, referential_id, oe_id, external_id):
+    """Report a new external id to the maps loaded by the running jobs"""
+    for id_map in _get_loaded_id_maps(dbname, model, referential_id):
+        id_map.add(oe_id, external_id)
+    return True
+
+
+def remove_from_id_maps(dbname, model, referential_id, external_id):
+    """Report a deleted external id to the maps loaded by the running jobs"""
+    for id_map in _get_loaded_id_maps(dbname, model, referential_id):
+        id_map.discard(external_id)
+    return True
@@ -0,0 +1,137 @@
+# -*- encoding: utf-8 -*-
+###############################################################################
+#                                                                             #
+#   Prestashoperpconnect for OpenERP                                          #
+#   Copyright (C) 2012 Akretion                                               #
+#                                                                             #
+#   This program is free software: you can redistribute it and/or modify      #
+#   it under the terms of the GNU Affero General Public License as            #
+#   published by the Free Software Foundation, either version 3 of the        #
+#   License, or (at your option) any later version.                           #
+#                                                                             #
+#   This program is distributed in the hope that it will be useful,           #
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of            #
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the             #
+#   GNU Affero General Public License for more details.                       #
+#                                                                             #
+#   You should have received a copy of the GNU Affero General Public License  #
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.     #
+#                                                                             #
+###############################################################################
+
+import threading
+import urlparse
+
+# Upper bounds (in seconds) of the latency histogram, with the name of the
+# counter of each bucket. The last bucket counts the slower calls
+LATENCY_BUCKETS = [
+    (0.05, 'hist_50ms'),
+    (0.2, 'hist_200ms'),
+    (1.0, 'hist_1s'),
+    (5.0, 'hist_5s'),
+    (None, 'hist_slower'),
+]
+
+_local = threading.local()
+
+
+class CallStats(object):
+    """Counters of the webservice calls made by one synchronisation job,
+    by resource and HTTP method"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = {}
+
+    def _get_counter(self, resource, method):
+        key = (resource, method)
+        if key not in self.counters:
+            counter = {
+                'calls': 0,
+                'errors': 0,
+                'retries': 0,
+                'skipped': 0,
+                'bytes_sent': 0,
+                'bytes_received': 0,
+                'total_time': 0.0,
+                'max_time': 0.0,
+            }
+            for limit, bucket in LATENCY_BUCKETS:
+                counter[bucket] = 0
+            self.counters[key] = counter
+        return self.counters[key]
+
+    def add_call(self, resource, method, duration, bytes_sent=0, bytes_received=0, error=False):
+        with self._lock:
+            counter = self._get_counter(resource, method)
+            counter['calls'] += 1
+            counter['errors'] += error and 1 or 0
+            counter['bytes_sent'] += bytes_sent
+            counter['bytes_received'] += bytes_received
+            counter['total_time'] += duration
+            counter['max_time'] = max(counter['max_time'], duration)
+            for limit, bucket in LATENCY_BUCKETS:
+                if limit is None or duration < limit:
+                    counter[bucket] += 1
+                    break
+
+    def add_retry(self, resource, method):
+        with self._lock:
+            self._get_counter(resource, method)['retries'] += 1
+
+    def add_skip(self, resource, method):
+        """Count a request which wasn't sent because its payload didn't change"""
+        with self._lock:
+            self._get_counter(resource, method)['skipped'] += 1
+
+    def get_totals(self):
+        """Return the number of calls, of errors and the time spent in the calls"""
+        with self._lock:
+            counters = self.counters.values()
+            return (sum([counter['calls'] for counter in counters]),
+                    sum([counter['errors'] for counter in counters]),
+                    sum([counter['total_time'] for counter in counters]))
+
+
+def get_current_stats():
+    """Return the CallStats of the job running in the current thread"""
+    return getattr(_local, 'stats', None)
+
+
+def set_current_stats(stats):
+    """Set the CallStats of the job running in the current thread and
+    return the previous one"""
+    previous = get_current_stats()
+    _local.stats = stats
+    return previous
+
+
+def get_resource_name(api_url, url):
+    """Return the resource of an url of the webservice, without the ids
+    (ex: 'images/products' for .../api/images/products/12/3?display=full)"""
+    path = urlparse.urlparse(url).path
+    api_path = urlparse.urlparse(api_url).path
+    if path.startswith(api_path):
+        path = path[len(api_path):]
+    return '/'.join([part for part in path.split('/') if part and not part.isdigit()])
+
+
+def record_call(resource, method, duration, bytes_sent=0, bytes_received=0, error=False):
+    stats = get_current_stats()
+    if stats is not None:
+        stats.add_call(resource, method, duration, bytes_sent=bytes_sent, bytes_received=bytes_received, error=error)
+    return True
+
+
+def record_retry(resource, method):
+    stats = get_current_stats()
+    if stats is not None:
+        stats.add_retry(resource, method)
+    return True
+
+
+def record_skip(resource, method):
+    stats = get_current_stats()
+    if stats is not None:
+        stats.add_skip(resource, method)
+    return True
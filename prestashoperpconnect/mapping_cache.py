@@ -0,0 +1,104 @@
+# -*- encoding: utf-8 -*-
+###############################################################################
+#                                                                             #
+#   Prestashoperpconnect for OpenERP                                          #
+#   Copyright (C) 2012 Akretion                                               #
+#                                                                             #
+#   This program is free software: you can redistribute it and/or modify      #
+#   it under the terms of the GNU Affero General Public License as            #
+#   published by the Free Software Foundation, either version 3 of the        #
+#   License, or (at your option) any later version.                           #
+#                                                                             #
+#   This program is distributed in the hope that it will be useful,           #
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of            #
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the             #
+#   GNU Affero General Public License for more details.                       #
+#                                                                             #
+#   You should have received a copy of the GNU Affero General Public License  #
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.     #
+#                                                                             #
+###############################################################################
+
+import threading
+
+# {(dbname, referential_id): {(mapping line id, function field): (source, code)}}
+_compiled_functions = {}
+_compiled_functions_lock = threading.Lock()
+
+# {(dbname, referential_id, model): (stamp, mapping, mapping_id)}
+_resolved_mappings = {}
+_resolved_mappings_lock = threading.Lock()
+
+
+def get_mapping_stamp(cr):
+    """Return a stamp of the mappings and mapping lines of the database,
+    which changes when one of them is created, written or deleted, whatever
+    the server process which modified it"""
+    stamp = ()
+    for table in ('external_mapping', 'external_mapping_line'):
+        cr.execute("SELECT count(*), max(id), max(coalesce(write_date, create_date)) FROM %s" % table)
+        stamp += cr.fetchone()
+    return stamp
+
+
+def get_resolved_mapping(cr, referential_id, model, resolve, stamp):
+    """Return the mapping of a model with a referential, as the tuple
+    (mapping, mapping_id) returned by _init_mapping. It is resolved by
+    calling resolve() once, then read from memory as long as the stamp of
+    the mappings (see get_mapping_stamp) doesn't change"""
+    key = (cr.dbname, referential_id, model)
+    with _resolved_mappings_lock:
+        cached = _resolved_mappings.get(key)
+        if cached and cached[0] == stamp:
+            return dict(cached[1]), cached[2]
+    mapping, mapping_id = resolve()
+    with _resolved_mappings_lock:
+        _resolved_mappings[key] = (stamp, mapping, mapping_id)
+    return dict(mapping), mapping_id
+
+
+def get_compiled_function(dbname, referential_id, mapping_line, function_field):
+    """Return the code object of the in_function or out_function of a mapping
+    line. It is compiled once, then again only when the source changes : the
+    mapping lines are read from the database (see get_resolved_mapping), so
+    a function modified by another server process is compiled again"""
+    source = mapping_line[function_field]
+    key = (mapping_line.get('id'), function_field)
+    with _compiled_functions_lock:
+        functions = _compiled_functions.setdefault((dbname, referential_id), {})
+        cached = functions.get(key)
+        if cached and cached[0] == source:
+            return cached[1]
+    code = compile(source, '<mapping line %s: %s>' % (mapping_line.get('id'), function_field), 'exec')
+    with _compiled_functions_lock:
+        functions[key] = (source, code)
+    return code
+
+
+def compile_mapping_lines(dbname, referential_id, mapping, convertion_type):
+    """Replace the source of the functions of the mapping lines of type
+    'function' by their code object, which the exec of the transformation
+    runs without compiling it again. The mapping is modified in place
+    :param dict mapping: mapping of one object, as mapping[mapping_id]
+    """
+    function_field = convertion_type == 'from_external_to_openerp' and 'in_function' or 'out_function'
+    for mapping_line in mapping.get('mapping_lines') or []:
+        if mapping_line.get('evaluation_type') == 'function' \
+                and isinstance(mapping_line.get(function_field), basestring):
+            mapping_line[function_field] = get_compiled_function(dbname, referential_id, mapping_line, function_field)
+    return mapping
+
+
+def invalidate_mapping_lines(dbname, line_ids=None):
+    """Forget the compiled functions of the mapping lines, or of all the
+    mapping lines of the database when no id is given"""
+    with _compiled_functions_lock:
+        for (cache_dbname, referential_id), functions in _compiled_functions.items():
+            if cache_dbname != dbname:
+                continue
+            if line_ids is None:
+                functions.clear()
+                continue
+            for key in functions.keys():
+                if key[0] in line_ids:
+                    del functions[key]
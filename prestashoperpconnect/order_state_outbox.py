@@ -0,0 +1,184 @@
+# -*- encoding: utf-8 -*-
+###############################################################################
+#                                                                             #
+#   Prestashoperpconnect for OpenERP                                          #
+#   Copyright (C) 2012 Akretion                                               #
+#                                                                             #
+#   This program is free software: you can redistribute it and/or modify      #
+#   it under the terms of the GNU Affero General Public License as            #
+#   published by the Free Software Foundation, either version 3 of the        #
+#   License, or (at your option) any later version.                           #
+#                                                                             #
+#   This program is distributed in the hope that it will be useful,           #
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of            #
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the             #
+#   GNU Affero General Public License for more details.                       #
+#                                                                             #
+#   You should have received a copy of the GNU Affero General Public License  #
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.     #
+#                                                                             #
+###############################################################################
+
+from osv import osv, fields
+from tools.translate import _
+from base_external_referentials.external_osv import ExternalSession
+from datetime import datetime, timedelta
+from openerp.tools import DEFAULT_SERVER_DATETIME_FORMAT
+from prestashop_osv import get_fetcher
+from instrumentation import record_retry
+from sync_stats import monitor_sync_job
+import logging
+
+_logger = logging.getLogger(__name__)
+
+# Number of orders whose state is pushed between two commits
+OUTBOX_BATCH_SIZE = 100
+
+# Delay before the first retry of a failed push, doubled at each retry
+RETRY_DELAY = 60
+RETRY_MAX_DELAY = 6 * 3600
+
+# The push of a state is abandoned after this number of attempts
+MAX_ATTEMPTS = 10
+
+
+class prestashop_order_state_outbox(osv.osv):
+    """States of the sale orders waiting to be pushed to PrestaShop. They are
+    saved by sale_order.write in the transaction of the user, then a cron
+    pushes them in batches : the write doesn't wait for PrestaShop"""
+    _name = 'prestashop.order.state.outbox'
+    _description = 'Sale order states to push to PrestaShop'
+    _rec_name = 'sale_id'
+    _order = 'id'
+
+    _columns = {
+        'create_date': fields.datetime('Date', readonly=True),
+        'sale_id': fields.many2one('sale.order', 'Sale Order', required=True, ondelete='cascade', select=True, readonly=True),
+        'referential_id': fields.many2one('external.referential', 'Referential', required=True, ondelete='cascade', readonly=True),
+        'ps_state_id': fields.integer('PrestaShop State ID', readonly=True),
+        'state': fields.selection([('pending', 'Pending'), ('failed', 'Failed')], 'State', readonly=True, select=True),
+        'attempts': fields.integer('Attempts', readonly=True),
+        'next_attempt': fields.datetime('Next Attempt', readonly=True),
+        'last_error': fields.text('Last Error', readonly=True),
+    }
+
+    _defaults = {
+        'state': 'pending',
+    }
+
+    def enqueue(self, cr, uid, order_states, context=None):
+        """Save the states to push, in the transaction of the caller
+        :param list order_states: list of tuples (sale id, referential id, PrestaShop state id)
+        """
+        if not order_states:
+            return True
+        cr.executemany("INSERT INTO prestashop_order_state_outbox "
+                       "(create_uid, create_date, sale_id, referential_id, ps_state_id, state, attempts) "
+                       "VALUES (%s, now() at time zone 'UTC', %s, %s, %s, 'pending', 0)",
+                       [(uid, sale_id, referential_id, ps_state_id) for sale_id, referential_id, ps_state_id in order_states])
+        return True
+
+    def _collapse_pending(self, cr, uid, context=None):
+        """Only the last state saved for an order is pushed"""
+        cr.execute("DELETE FROM prestashop_order_state_outbox AS old "
+                   "WHERE old.state = 'pending' AND EXISTS ("
+                   "    SELECT 1 FROM prestashop_order_state_outbox AS new "
+                   "    WHERE new.sale_id = old.sale_id AND new.state = 'pending' AND new.id > old.id)")
+        return True
+
+    def _get_due_entries(self, cr, uid, limit, context=None):
+        cr.execute("SELECT id, sale_id, referential_id, ps_state_id, attempts "
+                   "FROM prestashop_order_state_outbox "
+                   "WHERE state = 'pending' AND (next_attempt IS NULL OR next_attempt <= %s) "
+                   "ORDER BY id LIMIT %s",
+                   (datetime.utcnow().strftime(DEFAULT_SERVER_DATETIME_FORMAT), limit))
+        return cr.dictfetchall()
+
+    @monitor_sync_job('Push')
+    def _push_order_states(self, cr, uid, external_session, entries, context=None):
+        """Push the states of the entries to the referential of the session
+        :return: dictionary {entry id: error message or False when pushed}
+        :rtype: dict
+        """
+        sale_ext_ids = self.pool.get('sale.order').get_external_ids(cr, uid, external_session,
+                                    list(set([entry['sale_id'] for entry in entries])), context=context)
+        fetcher = get_fetcher(external_session)
+        pushes = {}
+        errors = {}
+        for entry in entries:
+            ext_id = sale_ext_ids.get(entry['sale_id'])
+            if not ext_id:
+                errors[entry['id']] = _("The sale order is not mapped with a PrestaShop order")
+                continue
+            if entry['attempts']:
+                record_retry('order_histories', 'POST')
+            order_history = {'order_history': {
+                'id_order': ext_id,
+                'id_order_state': entry['ps_state_id'],
+            }}
+            if fetcher:
+                pushes[entry['id']] = fetcher.submit(external_session.connection.add, 'order_histories', order_history)
+            else:
+                try:
+                    external_session.connection.add('order_histories', order_history)
+                    errors[entry['id']] = False
+                except Exception, e:
+                    errors[entry['id']] = unicode(e)
+        for entry_id, push in pushes.items():
+            try:
+                push.get()
+                errors[entry_id] = False
+            except Exception, e:
+                errors[entry_id] = unicode(e)
+        return errors
+
+    def _save_push_results(self, cr, uid, entries, errors, context=None):
+        pushed_ids = [entry_id for entry_id, error in errors.items() if not error]
+        if pushed_ids:
+            cr.execute("DELETE FROM prestashop_order_state_outbox WHERE id IN %s", (tuple(pushed_ids),))
+        now = datetime.utcnow()
+        for entry in entries:
+            error = errors.get(entry['id'])
+            if not error:
+                continue
+            attempts = entry['attempts'] + 1
+            delay = min(RETRY_DELAY * 2 ** (attempts - 1), RETRY_MAX_DELAY)
+            cr.execute("UPDATE prestashop_order_state_outbox "
+                       "SET attempts = %s, next_attempt = %s, last_error = %s, state = %s "
+                       "WHERE id = %s",
+                       (attempts, (now + timedelta(seconds=delay)).strftime(DEFAULT_SERVER_DATETIME_FORMAT),
+                        error, attempts >= MAX_ATTEMPTS and 'failed' or 'pending', entry['id']))
+            _logger.warning("The state of the sale order ID %s could not be pushed to PrestaShop (attempt %s): %s"
+                            % (entry['sale_id'], attempts, error))
+        return True
+
+    def run_outbox(self, cr, uid, batch_size=OUTBOX_BATCH_SIZE, context=None):
+        """Push the pending states to PrestaShop, by batches committed one
+        after the other. Called by the cron"""
+        ref_obj = self.pool.get('external.referential')
+        self._collapse_pending(cr, uid, context=context)
+        cr.commit()
+        while True:
+            entries = self._get_due_entries(cr, uid, batch_size, context=context)
+            if not entries:
+                break
+            entries_by_ref = {}
+            for entry in entries:
+                entries_by_ref.setdefault(entry['referential_id'], []).append(entry)
+            errors = {}
+            for referential_id, ref_entries in entries_by_ref.items():
+                try:
+                    referential = ref_obj.browse(cr, uid, referential_id, context=context)
+                    external_session = ExternalSession(referential)
+                    errors.update(self._push_order_states(cr, uid, external_session, ref_entries, context=context))
+                except Exception, e:
+                    # ex: PrestaShop can't be reached
+                    for entry in ref_entries:
+                        errors[entry['id']] = unicode(e)
+            self._save_push_results(cr, uid, entries, errors, context=context)
+            cr.commit()
+        return True
+
+    def retry(self, cr, uid, ids, context=None):
+        self.write(cr, uid, ids, {'state': 'pending', 'attempts': 0, 'next_attempt': False}, context=context)
+        return True
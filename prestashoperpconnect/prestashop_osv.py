@@ -31,10 +31,102 @@ from tools.translate import _
 from datetime import datetime
 from openerp.tools import DEFAULT_SERVER_DATETIME_FORMAT
 from prestapyt import PrestaShopWebServiceError
+from fetcher import ConcurrentFetcher, get_limiter
+from id_map import ExternalIdMap, add_to_id_maps
+from mapping_cache import compile_mapping_lines, get_mapping_stamp, get_resolved_mapping
+from sync_stats import monitor_sync_job
+from instrumentation import record_skip
+from export_digest import compute_payload_digest
 import logging
 
 _logger = logging.getLogger(__name__)
 
+# Maximum number of ids given in a filter[id]=[a|b|c] request
+BATCH_READ_SIZE = 100
+
+# Number of resources recorded at once by the streamed imports
+STREAM_CHUNK_SIZE = 20
+
+
+def get_list_elements(response):
+    """Return the list of resources of a list response of the webservice.
+    A list response looks like {'order_details': {'order_detail': [...]}},
+    with a dict instead of a list when there is only one resource and an
+    empty string when there is none.
+    In JSON, it looks like {'order_details': [...]}, or [] when there is none"""
+    elements = response and response[response.keys()[0]]
+    if not elements:
+        return []
+    if isinstance(elements, list):
+        return elements
+    elements = elements[[key for key in elements.keys() if key != 'attrs'][0]]
+    if isinstance(elements, dict):
+        elements = [elements]
+    return elements
+
+def get_field_value(value):
+    """Return the value of a field of a resource read in XML : the fields
+    linked to another resource (xlink) are read as {'attrs': ..., 'value': ...}"""
+    if isinstance(value, dict):
+        return value.get('value')
+    return value
+
+def use_json(external_session):
+    return external_session.referential_id.output_format == 'json'
+
+def webservice_get(external_session, *args, **kwargs):
+    """Read the webservice in the output format of the referential"""
+    if use_json(external_session):
+        return external_session.connection.get_json(*args, **kwargs)
+    return external_session.connection.get(*args, **kwargs)
+
+def session_cache(external_session, key):
+    """Return a dictionary stored on the external session, used to keep
+    data for the lifetime of one synchronisation"""
+    if not hasattr(external_session, 'tmp'):
+        external_session.tmp = {}
+    return external_session.tmp.setdefault(key, {})
+
+def get_fetcher(external_session):
+    """Return the ConcurrentFetcher of the session, or None when the
+    referential reads the webservice with only one request at a time"""
+    referential = external_session.referential_id
+    if (referential.fetch_workers or 1) <= 1:
+        return None
+    fetchers = session_cache(external_session, 'fetcher')
+    if not fetchers.get(referential.id):
+        limiter = get_limiter(referential._cr.dbname, referential.id,
+                              referential.fetch_workers, referential.fetch_rate_limit)
+        fetchers[referential.id] = ConcurrentFetcher(limiter)
+    return fetchers[referential.id]
+
+def prefetch_resources(external_session, ext_resource, external_ids, json=False):
+    """Start reading the given resources in the threads of the fetcher,
+    fetch_resource() will then return them without waiting for the webservice
+    :param bool json: read the resources in JSON instead of XML
+    :return: False if the referential doesn't read the webservice concurrently
+    """
+    fetcher = get_fetcher(external_session)
+    if not fetcher:
+        return False
+    get = json and external_session.connection.get_json or external_session.connection.get
+    prefetched = session_cache(external_session, 'prefetch')
+    for external_id in external_ids:
+        key = (ext_resource, int(external_id), json)
+        if key not in prefetched:
+            prefetched[key] = fetcher.submit(get, ext_resource, external_id)
+    return True
+
+def fetch_resource(external_session, ext_resource, external_id, json=False):
+    """Return the answer of the webservice for one resource, taken from the
+    prefetched resources when it was prefetched"""
+    prefetched = session_cache(external_session, 'prefetch').pop((ext_resource, int(external_id), json), None)
+    if prefetched is not None:
+        return prefetched.get()
+    if json:
+        return external_session.connection.get_json(ext_resource, external_id)
+    return external_session.connection.get(ext_resource, external_id)
+
 @override(osv.osv, '_prestashop')
 @only_for_referential('prestashop')
 def _transform_field(self, cr, uid, external_session, convertion_type, field_value, mapping_line, context=None):
@@ -45,10 +137,84 @@ def _transform_field(self, cr, uid, external_session, convertion_type, field_val
             field_value = None
     return self._prestashop_transform_field(cr, uid, external_session, convertion_type, field_value, mapping_line, context=context)
 
+@override(osv.osv, 'prestashop_')
+@only_for_referential('prestashop')
+def _transform_one_resource(self, cr, uid, external_session, convertion_type, resource, mapping=None, mapping_id=None, **kwargs):
+    # The functions of the mapping lines are executed for each resource,
+    # they are compiled once instead of at each exec
+    if mapping and mapping_id in mapping:
+        compile_mapping_lines(cr.dbname, external_session.referential_id.id, mapping[mapping_id], convertion_type)
+    return self.prestashop__transform_one_resource(cr, uid, external_session, convertion_type, resource,
+                                                  mapping=mapping, mapping_id=mapping_id, **kwargs)
+
+@extend(osv.osv)
+def get_external_id_map(self, cr, uid, external_session, context=None):
+    """Return the ExternalIdMap of the object on the referential of the
+    session. It is loaded with one query the first time it is asked during
+    the session, then kept up to date by create_external_id_vals
+    :rtype: ExternalIdMap
+    """
+    id_maps = session_cache(external_session, 'id_maps')
+    if self._name not in id_maps:
+        # Only keep the external ids of the records which still exist
+        cr.execute("SELECT d.name, d.res_id FROM ir_model_data d "
+                   "JOIN " + self._table + " t ON t.id = d.res_id "
+                   "WHERE d.model = %s AND d.referential_id = %s",
+                   (self._name, external_session.referential_id.id))
+        ext_to_oe = dict([(self.id_from_prefixed_id(name), res_id) for name, res_id in cr.fetchall()])
+        id_maps[self._name] = ExternalIdMap(cr.dbname, self._name, external_session.referential_id.id, ext_to_oe)
+    return id_maps[self._name]
+
+@extend(osv.osv)
+def get_external_ids(self, cr, uid, external_session, oe_ids, context=None):
+    """Return the external ids of the given records on the referential of
+    the session with one query, for the jobs which only need a few of them
+    (get_external_id_map loads all the external ids of the object)
+    :return: dictionary {oe_id: external_id}
+    :rtype: dict
+    """
+    if not oe_ids:
+        return {}
+    cr.execute("SELECT res_id, name FROM ir_model_data "
+               "WHERE model = %s AND referential_id = %s AND res_id IN %s",
+               (self._name, external_session.referential_id.id, tuple(oe_ids)))
+    return dict([(res_id, self.id_from_prefixed_id(name)) for res_id, name in cr.fetchall()])
+
+@override(osv.osv, 'prestashop_')
+def create_external_id_vals(self, cr, uid, existing_rec_id, external_id, referential_id, context=None):
+    res = self.prestashop_create_external_id_vals(cr, uid, existing_rec_id, external_id, referential_id, context=context)
+    add_to_id_maps(cr.dbname, self._name, referential_id, existing_rec_id, external_id)
+    return res
+
+@extend(osv.osv)
+def get_prestashop_lang_map(self, cr, uid, external_session, lang_codes=None, context=None):
+    """Return the PrestaShop language id of each language code. The map is
+    computed once per session for the active languages of the referential,
+    and computed again if the active languages change
+    :param list lang_codes: codes of languages which may not be active
+    :return: dictionary {lang code: PrestaShop language id}
+    :rtype: dict
+    """
+    lang_obj = self.pool.get('res.lang')
+    referential_id = external_session.referential_id.id
+    lang_maps = session_cache(external_session, 'lang_map')
+    active_langs = tuple(sorted([(lang.id, lang.code) for lang in external_session.referential_id.active_language_ids]))
+    if active_langs not in lang_maps:
+        lang_maps.clear()
+        lang_maps[active_langs] = dict([(code, lang_obj.get_extid(cr, uid, lang_id, referential_id, context=context))
+                                            for lang_id, code in active_langs])
+    lang_map = lang_maps[active_langs]
+    for code in lang_codes or []:
+        if code not in lang_map:
+            lang_id = lang_obj.search(cr, uid, [('code', '=', code)], context=context)[0]
+            lang_map[code] = lang_obj.get_extid(cr, uid, lang_id, referential_id, context=context)
+    return lang_map
+
 @extend(osv.osv)
 @only_for_referential('prestashop')
 def get_resources_with_lang(self, cr, uid, external_session, resources, primary_key, context=None):
     new_resources = {}
+    lang_map = self.get_prestashop_lang_map(cr, uid, external_session, context=context)
     for resource_id, resource in resources.items():
         new_resource = {}
         for lang, fields in resource.items():
@@ -57,8 +223,9 @@ def get_resources_with_lang(self, cr, uid, external_session, resources, primary_
                     resource['no_lang']['id'] = resource['no_lang'].pop('ext_id')
                 new_resource.update(resource['no_lang'])
             else:
-                lang_id = self.pool.get('res.lang').search(cr, uid, [('code', '=', lang)], context=context)[0]
-                presta_id = self.pool.get('res.lang').get_extid(cr, uid, lang_id, external_session.referential_id.id, context=context)
+                if lang not in lang_map:
+                    lang_map = self.get_prestashop_lang_map(cr, uid, external_session, lang_codes=[lang], context=context)
+                presta_id = lang_map[lang]
                 for field, value in fields.items():
                     if field == 'ext_id':
                         continue
@@ -92,11 +259,30 @@ def call_prestashop_method(self, cr, uid, external_session, resource_id, resourc
 def ext_create_or_update(self, cr, uid, external_session, resources, method, mapping=None, mapping_id=None, context=None):
     """Contains common code for ext_create() and ext_update()"""
     res = {}
-    mapping, mapping_id = self._init_mapping(cr, uid, external_session.referential_id.id, mapping=mapping, mapping_id=mapping_id, context=context)
+    if not mapping:
+        mapping, mapping_id = self._get_prestashop_mapping(cr, uid, external_session, context=context)
+    else:
+        mapping, mapping_id = self._init_mapping(cr, uid, external_session.referential_id.id, mapping=mapping, mapping_id=mapping_id, context=context)
     primary_key = mapping[mapping_id]['prestashop_primary_key']
     presta_resources = self.get_resources_with_lang(cr, uid, external_session, resources, primary_key, context=context)
+    # Don't send again a resource which didn't change since its last export
+    digest_obj = self.pool.get('prestashop.export.digest')
+    referential_id = external_session.referential_id.id
+    ext_resource = mapping[mapping_id]['external_resource_name']
+    skipped = 0
     for resource_id, resource in presta_resources.items():
+        # computed before the call, which may modify the resource
+        payload_digest = compute_payload_digest(resource[primary_key])
+        if method == 'edit' and payload_digest == digest_obj.get_digest(cr, uid, self._name, resource_id,
+                                                            referential_id, 'payload', context=context):
+            res[resource_id] = resource[primary_key].get('id')
+            record_skip(ext_resource, 'PUT')
+            skipped += 1
+            continue
         res[resource_id] = self.call_prestashop_method(cr, uid, external_session, resource_id, resource, method, mapping=mapping, mapping_id=mapping_id, context=context)
+        digest_obj.set_digest(cr, uid, self._name, resource_id, referential_id, 'payload', payload_digest, context=context)
+    if skipped:
+        _logger.info("%s %s resources didn't change since their last export, skipped" % (skipped, ext_resource))
     return res
 
 
@@ -132,55 +318,224 @@ def _get_last_imported_date(self, cr, uid, external_session, context=None):
 def _set_last_imported_date(self, cr, uid, external_session, date, context=None):
     return True
 
+@extend(osv.osv)
+@only_for_referential('prestashop')
+def _get_last_imported_id(self, cr, uid, external_session, context=None):
+    """Return the id of the last resource recorded by an import which
+    didn't reach its end, this import will be resumed after this id"""
+    return False
+
+@extend(osv.osv)
+@only_for_referential('prestashop')
+def _set_last_imported_id(self, cr, uid, external_session, last_id, context=None):
+    return True
+
+@extend(osv.osv)
+@only_for_referential('prestashop')
+def _get_resumed_import_date(self, cr, uid, external_session, context=None):
+    """Return the date of the beginning of the import which didn't reach
+    its end, saved with the id returned by _get_last_imported_id"""
+    return False
+
+@extend(osv.osv)
+@only_for_referential('prestashop')
+def _set_resumed_import_date(self, cr, uid, external_session, date, context=None):
+    return True
+
+@override(osv.osv, 'prestashop_')
+@only_for_referential('prestashop')
+@monitor_sync_job('Import')
+def _import_resources(self, cr, uid, external_session, defaults=None, method="search_then_read", context=None):
+    """When the referential reads the resources by page, the resources of
+    each page of _get_filter are read with one request (display=full) and
+    recorded as a batch instead of being read one by one"""
+    if method == 'search_then_read' and external_session.referential_id.read_by_page:
+        if external_session.referential_id.stream_responses and not use_json(external_session):
+            return self._import_resources_by_stream(cr, uid, external_session, defaults=defaults, context=context)
+        method = 'search_read'
+    if method == 'search_then_read' and get_fetcher(external_session):
+        # The resources of each page are read by the fetcher while the
+        # previous ones are recorded
+        context = dict(context or {}, prefetch_resources=True)
+    return self.prestashop__import_resources(cr, uid, external_session, defaults=defaults, method=method, context=context)
+
+@override(osv.osv, 'prestashop_')
+@only_for_referential('prestashop')
+@monitor_sync_job('Export')
+def _export_resources(self, cr, uid, external_session, method="onebyone", context=None):
+    return self.prestashop__export_resources(cr, uid, external_session, method=method, context=context)
+
 @override(osv.osv, 'prestashop_')
 @only_for_referential('prestashop')
 def _get_filter(self, cr, uid, external_session, step, previous_filter=None, context=None):
     """
     Used to limit the query in external library
+    The pages are sorted by id and each page starts after the last id of
+    the previous one. When a page is asked, the previous one is recorded,
+    so its last id is saved : an import which stops is resumed after it.
+    The date of the last import is only set when the last page is reached
+    (see _end_of_page)
     :param ExternalSession external_session : External_session that contain all params of connection
     :param int step: Step the of the import, 100 meant you will import data per 100
     :param dict previous_filter: the previous filter
     :return: dictionary with a filter
     :rtype: dict
     """
-    if not previous_filter:
-        start = 0
-    else:
-        start = sum([int(x) for x in previous_filter['limit'].split(',')])
+    pages = session_cache(external_session, 'import_pages')
+    if not previous_filter or self._name not in pages:
+        last_id = self._get_last_imported_id(cr, uid, external_session, context=context) or 0
+        # A resumed import keeps the date of the beginning of the interrupted
+        # one, so the resources modified since then are read by the next import
+        start_date = last_id and self._get_resumed_import_date(cr, uid, external_session, context=context) or False
+        pages[self._name] = {
+            'start_date': start_date or datetime.today().strftime(DEFAULT_SERVER_DATETIME_FORMAT),
+            'start_date_saved': bool(start_date),
+            'last_id': last_id,
+            'page_ids': [],
+        }
+    page = pages[self._name]
+    if previous_filter and page['page_ids']:
+        page['last_id'] = max(page['page_ids'])
+        self._set_last_imported_id(cr, uid, external_session, page['last_id'], context=context)
+        if not page['start_date_saved']:
+            self._set_resumed_import_date(cr, uid, external_session, page['start_date'], context=context)
+            page['start_date_saved'] = True
     resource_filter = {
-        'limit': "%s,%s"%(start,step),
+        'limit': step,
+        'sort': '[id_ASC]',
     }
+    if page['last_id']:
+        resource_filter['filter[id]'] = '>[%s]' % page['last_id']
     last_export = self._get_last_imported_date(cr, uid, external_session, context=context)
-    self._set_last_imported_date(cr, uid, external_session, date='default', context=context)
     if last_export:
         date = datetime.strptime(last_export,  DEFAULT_SERVER_DATETIME_FORMAT)
         resource_filter['date_filter'] = [['date_upd', '>', date]]
+    page['filter'] = resource_filter
     return resource_filter
 
+@extend(osv.osv)
+def _end_of_page(self, cr, uid, external_session, resource_filter, ext_ids, context=None):
+    """Called with the ids read for a filter built by _get_filter. When the
+    page is empty, all the resources are recorded : the date of the beginning
+    of the import becomes the date of the last import"""
+    pages = session_cache(external_session, 'import_pages')
+    page = pages.get(self._name)
+    if not page or page.get('filter') is not resource_filter:
+        return False
+    page['page_ids'] = [int(ext_id) for ext_id in ext_ids]
+    if not ext_ids:
+        self._set_last_imported_date(cr, uid, external_session, date=page['start_date'], context=context)
+        self._set_last_imported_id(cr, uid, external_session, False, context=context)
+        self._set_resumed_import_date(cr, uid, external_session, False, context=context)
+        del pages[self._name]
+    return True
+
+@extend(osv.osv)
+def _get_prestashop_mapping(self, cr, uid, external_session, context=None):
+    """Return the mapping of the object with the referential as the tuple
+    (mapping, mapping_id), without reading it again from the database until
+    a mapping or a mapping line is modified, which is checked once per
+    synchronisation (see get_mapping_stamp)"""
+    referential_id = external_session.referential_id.id
+    # The stamp is read once per synchronisation, not at each lookup
+    stamps = session_cache(external_session, 'mapping_stamp')
+    if cr.dbname not in stamps:
+        stamps[cr.dbname] = get_mapping_stamp(cr)
+    def resolve():
+        return self._init_mapping(cr, uid, referential_id, context=context)
+    return get_resolved_mapping(cr, referential_id, self._name, resolve, stamps[cr.dbname])
+
+@extend(osv.osv)
+def _get_prestashop_resource_name(self, cr, uid, external_session, mapping=None, context=None):
+    """Return the name of the PrestaShop resource mapped with the object"""
+    resolved_mapping, mapping_id = self._get_prestashop_mapping(cr, uid, external_session, context=context)
+    if not mapping or mapping_id not in mapping:
+        mapping = resolved_mapping
+    return mapping[mapping_id]['external_resource_name']
+
 @override(osv.osv, 'prestashop_')
 @only_for_referential('prestashop')
 def _get_external_resource_ids(self, cr, uid, external_session, resource_filter=None, mapping=None, context=None):
-    search_vals = [('model', '=', self._name), ('referential_id', '=', external_session.referential_id.id)]
-    mapping_ids = self.pool.get('external.mapping').search(cr, uid, search_vals)
-    if mapping is None:
-        mapping = {mapping_ids[0] : self._get_mapping(cr, uid, external_session.referential_id.id, context=context)}
-    ext_resource = mapping[mapping_ids[0]]['external_resource_name']
-    return external_session.connection.search(ext_resource, options = resource_filter)
+    ext_resource = self._get_prestashop_resource_name(cr, uid, external_session, mapping=mapping, context=context)
+    ext_ids = external_session.connection.search(ext_resource, options = resource_filter)
+    self._end_of_page(cr, uid, external_session, resource_filter, ext_ids, context=context)
+    if context and context.get('prefetch_resources'):
+        prefetch_resources(external_session, ext_resource, ext_ids, json=use_json(external_session))
+    return ext_ids
 
 @override(osv.osv, 'prestashop_')
 @only_for_referential('prestashop')
 def _get_external_resources(self, cr, uid, external_session, external_id=None, resource_filter=None, mapping=None, fields=None, context=None):
-    #TODO begin refactor with _get_external_resource_ids()
-    search_vals = [('model', '=', self._name), ('referential_id', '=', external_session.referential_id.id)]
-    mapping_ids = self.pool.get('external.mapping').search(cr, uid, search_vals)
-    if mapping is None:
-        mapping = {mapping_ids[0] : self._get_mapping(cr, uid, external_session.referential_id.id, context=context)}
-    # end refactor
+    ext_resource = self._get_prestashop_resource_name(cr, uid, external_session, mapping=mapping, context=context)
+    if external_id is None:
+        # Bulk mode : read the whole page of the filter in one request
+        options = dict(resource_filter or {}, display='full')
+        response = webservice_get(external_session, ext_resource, options=options)
+        resources = get_list_elements(response)
+        self._end_of_page(cr, uid, external_session, resource_filter, [resource['id'] for resource in resources], context=context)
+        result = []
+        for resource in resources:
+            result += self._flatten_prestashop_resource(cr, uid, external_session, resource, context=context)
+        return self._process_external_resources(cr, uid, external_session, result, context=context)
+    resource = fetch_resource(external_session, ext_resource, external_id, json=use_json(external_session))
+    resource = resource[resource.keys()[0]]
+    result = self._flatten_prestashop_resource(cr, uid, external_session, resource, context=context)
+    return self._process_external_resources(cr, uid, external_session, result, context=context)
+
+@extend(osv.osv)
+def _process_external_resources(self, cr, uid, external_session, resources, context=None):
+    """Hook called on the flattened resources read by _get_external_resources
+    or by the streamed import, before they are recorded.
+    This function is designed to be inherited !"""
+    return resources
+
+@extend(osv.osv)
+def _import_resources_by_stream(self, cr, uid, external_session, defaults=None, context=None):
+    """Same as the search_read import, except that the XML answer of each
+    page is parsed while it is read : the resources are flattened one at a
+    time and recorded by chunks of STREAM_CHUNK_SIZE, so the memory used
+    doesn't depend on the size of the page"""
+    result = {"create_ids": [], "write_ids": []}
+    mapping, mapping_id = self._get_prestashop_mapping(cr, uid, external_session, context=context)
+    ext_resource = mapping[mapping_id]['external_resource_name']
+    step = self._get_import_step(cr, uid, external_session, context=context)
+
+    def record_chunk(chunk):
+        resources = self._process_external_resources(cr, uid, external_session, chunk, context=context)
+        res = self._record_external_resources(cr, uid, external_session, resources, defaults=defaults,
+                                              mapping=mapping, mapping_id=mapping_id, context=context)
+        for key in result:
+            result[key].append(res.get(key, []))
+
+    resource_filter = None
+    while True:
+        resource_filter = self._get_filter(cr, uid, external_session, step, previous_filter=resource_filter, context=context)
+        options = dict(resource_filter, display='full')
+        page_ids = []
+        chunk = []
+        for resource in external_session.connection.iter_resources(ext_resource, options=options):
+            page_ids.append(resource['id'])
+            chunk += self._flatten_prestashop_resource(cr, uid, external_session, resource, context=context)
+            if len(page_ids) % STREAM_CHUNK_SIZE == 0:
+                record_chunk(chunk)
+                chunk = []
+        if chunk:
+            record_chunk(chunk)
+        self._end_of_page(cr, uid, external_session, resource_filter, page_ids, context=context)
+        if not page_ids:
+            break
+    return result
+
+@extend(osv.osv)
+def _flatten_prestashop_resource(self, cr, uid, external_session, resource, context=None):
+    """Convert a resource read from the webservice into the list of dicts
+    expected by the mapping : the first dict contains the fields without
+    language and the fields of one language, then one dict per other language
+    """
+    if use_json(external_session):
+        return self._flatten_prestashop_json_resource(cr, uid, external_session, resource, context=context)
     lang_resource = {}
     main_data = {}
-    ext_resource = mapping[mapping_ids[0]]['external_resource_name']
-    resource = external_session.connection.get(ext_resource, external_id)
-    resource = resource[resource.keys()[0]]
     for key in resource:
         if key == 'associations':
             for key_one in resource[key].keys():
@@ -202,6 +557,41 @@ def _get_external_resources(self, cr, uid, external_session, external_id=None, r
             main_data[key] = resource[key]['value']
         else:
             main_data[key] = resource[key]
+    return _merge_lang_resources(main_data, lang_resource)
+
+@extend(osv.osv)
+def _flatten_prestashop_json_resource(self, cr, uid, external_session, resource, context=None):
+    """Same as _flatten_prestashop_resource for a resource read in JSON, where
+    the associations are lists of dicts, the fields with languages are lists
+    of {'id': lang id, 'value': value} and the numbers are not strings"""
+    lang_resource = {}
+    main_data = {}
+    resource_id = _json_value(resource.get('id'))
+    for key, value in resource.items():
+        if key == 'associations':
+            for key_one, vals in value.items():
+                if isinstance(vals, dict):
+                    vals = [vals]
+                main_data[key_one] = [int(val['id']) for val in vals or []]
+        elif isinstance(value, list) and value and isinstance(value[0], dict) and 'value' in value[0]:
+            for lang_val in value:
+                lang_id = _json_value(lang_val['id'])
+                if not lang_resource.get(lang_id):
+                    lang_resource[lang_id] = {'ext_lang_id': lang_id, 'id': resource_id}
+                lang_resource[lang_id][key] = _json_value(lang_val['value'])
+        else:
+            main_data[key] = _json_value(value)
+    return _merge_lang_resources(main_data, lang_resource)
+
+def _json_value(value):
+    """Return the value as it would be read in XML"""
+    if value is None:
+        return ''
+    if isinstance(value, (int, long, float)):
+        return unicode(value)
+    return value
+
+def _merge_lang_resources(main_data, lang_resource):
     #TODO Improve when the lang will be mapped
     lang_ids = lang_resource.keys()
     if lang_ids:
@@ -213,16 +603,53 @@ def _get_external_resources(self, cr, uid, external_session, external_id=None, r
         result.append(lang_resource[lang_id])
     return result
 
+@extend(osv.osv)
+def _get_external_resources_by_ids(self, cr, uid, external_session, ext_resource, external_ids, context=None):
+    """Read several resources of the webservice with one request per chunk
+    of BATCH_READ_SIZE ids (filter[id]=[a|b|c] and display=full)
+    :param str ext_resource: name of the resource in PrestaShop (ex: 'order_details')
+    :param list external_ids: ids of the resources to read
+    :return: dictionary {external_id: flattened resource}, the flattened
+        resource being processed by _process_external_resources, as returned
+        by _get_external_resources for this id
+    :rtype: dict
+    """
+    res = {}
+    external_ids = sorted(set([int(external_id) for external_id in external_ids]))
+    options_list = []
+    for start in range(0, len(external_ids), BATCH_READ_SIZE):
+        chunk = external_ids[start:start + BATCH_READ_SIZE]
+        options_list.append({
+            'filter[id]': '[%s]' % '|'.join([str(external_id) for external_id in chunk]),
+            'display': 'full',
+        })
+    fetcher = len(options_list) > 1 and get_fetcher(external_session)
+    if fetcher:
+        responses = [fetcher.submit(webservice_get, external_session, ext_resource, options=options)
+                        for options in options_list]
+    else:
+        responses = [webservice_get(external_session, ext_resource, options=options)
+                        for options in options_list]
+    for response in responses:
+        if fetcher:
+            response = response.get()
+        for resource in get_list_elements(response):
+            result = self._flatten_prestashop_resource(cr, uid, external_session, resource, context=context)
+            res[int(resource['id'])] = self._process_external_resources(cr, uid, external_session, result, context=context)
+    return res
+
 @override(osv.osv, 'prestashop_')
 @only_for_referential('prestashop')
 def _record_one_external_resource(self, cr, uid, external_session, resource, defaults=None, mapping=None, mapping_id=None, context=None):
     lang_obj = self.pool.get('res.lang')
     ext_lang_id = resource.get('ext_lang_id', False)
     if ext_lang_id:
-        oe_lang_id = lang_obj.extid_to_existing_oeid(cr, uid, external_session.referential_id.id, ext_lang_id, context=context)
+        oe_lang_id = lang_obj.get_external_id_map(cr, uid, external_session, context=context).get_oeid(ext_lang_id)
         if oe_lang_id:
-            lang = lang_obj.read(cr, uid, oe_lang_id, ['code'], context=context)
-            context['lang'] = lang['code']
+            lang_codes = session_cache(external_session, 'lang_codes')
+            if oe_lang_id not in lang_codes:
+                lang_codes[oe_lang_id] = lang_obj.read(cr, uid, oe_lang_id, ['code'], context=context)['code']
+            context['lang'] = lang_codes[oe_lang_id]
     return self.prestashop__record_one_external_resource(cr, uid, external_session, \
                     resource, defaults=defaults, mapping=mapping, context=context)
 
@@ -23,7 +23,16 @@
 
 from osv import osv, fields
 from base_external_referentials.decorator import only_for_referential, catch_error_in_report, open_report
+from tools.translate import _
+from prestashop_osv import get_fetcher
+from sync_stats import monitor_sync_job
+from datetime import datetime, timedelta
+from openerp.tools import DEFAULT_SERVER_DATETIME_FORMAT
+from openerp import pooler
 import json
+import logging
+
+_logger = logging.getLogger(__name__)
 
 class product_product(osv.osv):
     _inherit='product.product'
@@ -38,29 +47,143 @@ class product_product(osv.osv):
     def _record_one_external_resource(self, *args, **kwargs):
         return super(product_product, self)._record_one_external_resource(*args, **kwargs)
 
+    def _is_full_stock_export(self, cr, uid, external_session, context=None):
+        """Return True when all the quantities must be pushed to the shop of
+        the session, even the ones which didn't change since their last push :
+        when the shop is configured so, when it is asked in the context
+        (export_all_stock) or when the periodic full resync of the shop is due"""
+        shop = external_session.sync_from_object
+        if not shop.export_changed_stock_only or (context and context.get('export_all_stock')):
+            return True
+        if not shop.stock_full_resync_interval:
+            return False
+        if not shop.last_full_stock_resync_date:
+            return True
+        last_resync = datetime.strptime(shop.last_full_stock_resync_date, DEFAULT_SERVER_DATETIME_FORMAT)
+        return last_resync + timedelta(days=shop.stock_full_resync_interval) <= datetime.now()
+
+    def _get_stock_to_export(self, cr, uid, external_session, product_ids, export_all=False, context=None):
+        """Return the quantity of each product whose stock changed since the
+        last time it was pushed to the shop of the session, or of all the
+        products when export_all is True
+        :return: dictionary {product_id: quantity}
+        :rtype: dict
+        """
+        quantities = dict([(product['id'], int(product['qty_available']))
+                for product in self.read(cr, uid, product_ids, ['qty_available'], context=context)])
+        if not quantities:
+            return {}
+        shop = external_session.sync_from_object
+        if export_all:
+            return quantities
+        cr.execute("SELECT product_id, quantity FROM prestashop_stock_level "
+                   "WHERE shop_id = %s AND product_id IN %s",
+                   (shop.id, tuple(quantities.keys())))
+        for product_id, quantity in cr.fetchall():
+            if quantities.get(product_id) == quantity:
+                del quantities[product_id]
+        return quantities
+
+    def _set_exported_stock(self, cr, uid, external_session, quantities, context=None):
+        """Save the quantities pushed to the shop of the session"""
+        if not quantities:
+            return True
+        shop_id = external_session.sync_from_object.id
+        cr.execute("DELETE FROM prestashop_stock_level "
+                   "WHERE shop_id = %s AND product_id IN %s",
+                   (shop_id, tuple(quantities.keys())))
+        cr.executemany("INSERT INTO prestashop_stock_level (product_id, shop_id, quantity) "
+                       "VALUES (%s, %s, %s)",
+                       [(product_id, shop_id, quantity) for product_id, quantity in quantities.items()])
+        return True
+
+    @monitor_sync_job('Stock export')
     def export_inventory(self, cr, uid, external_session, product_ids, context=None):
         """
+        Only the products whose quantity changed since the last export to the
+        shop are pushed, unless a full export is due (see _is_full_stock_export)
         :param list product_ids: list of product
         :rtype: boolean
         :return: boolean
         """
-        for product in self.browse(cr, uid, product_ids, context=context):
-            ext_id = product.get_extid(external_session.referential_id.id, context=context)
+        product_map = self.get_external_id_map(cr, uid, external_session, context=context)
+        shop_ext_id = external_session.sync_from_object.get_extid(external_session.referential_id.id)
+        export_all = self._is_full_stock_export(cr, uid, external_session, context=context)
+        quantities = self._get_stock_to_export(cr, uid, external_session, product_ids, export_all=export_all, context=context)
+        fetcher = get_fetcher(external_session)
+        pushes = {}
+        error = None
+        unmapped = 0
+        for product_id, quantity in quantities.items():
+            ext_id = product_map.get_extid(product_id)
+            if not ext_id:
+                external_session.logger.warning(_("Product ID %s is not mapped, its stock is not exported") % product_id)
+                unmapped += 1
+                continue
             params = {
                 'id': json.dumps({"id_product":ext_id, "id_product_attribute":0}),
-                'quantity': int(product.qty_available),
+                'quantity': quantity,
                 'id_product': ext_id,
                 'id_product_attribute': 0,
                 'depends_on_stock': 1,
-                'out_of_stock': product.qty_available > 0 and 1 or 0,
-                'id_shop': external_session.sync_from_object.get_extid(external_session.referential_id.id),
+                'out_of_stock': quantity > 0 and 1 or 0,
+                'id_shop': shop_ext_id,
                 #'id_shop_group': 0, TODO fix me
             }
-            external_session.connection.edit('stock_availables', {'stock_available':params})
-
+            if fetcher:
+                pushes[product_id] = fetcher.submit(external_session.connection.edit, 'stock_availables', {'stock_available':params})
+            else:
+                # Like with the fetcher, a failed push doesn't stop the other ones
+                try:
+                    external_session.connection.edit('stock_availables', {'stock_available':params})
+                    pushes[product_id] = None
+                except Exception, e:
+                    error = error or e
+        pushed = {}
+        for product_id, push in pushes.items():
+            try:
+                if push:
+                    push.get()
+                pushed[product_id] = quantities[product_id]
+            except Exception, e:
+                error = error or e
+        external_session.logger.info(_("Stock export: %s products pushed, %s failed, %s unchanged products skipped, %s unmapped products skipped")
+                                     % (len(pushed), len(quantities) - unmapped - len(pushed), len(product_ids) - len(quantities), unmapped))
+        if error:
+            # The transaction is rolled back by the error : what was pushed is
+            # saved with its own cursor, these products are up to date in PrestaShop
+            stock_cr = pooler.get_db(cr.dbname).cursor()
+            try:
+                self._set_exported_stock(stock_cr, uid, external_session, pushed, context=context)
+                stock_cr.commit()
+            except Exception:
+                _logger.exception("The stock levels pushed to the shop ID %s could not be saved" % external_session.sync_from_object.id)
+                stock_cr.rollback()
+            finally:
+                stock_cr.close()
+            raise error
+        self._set_exported_stock(cr, uid, external_session, pushed, context=context)
+        if export_all:
+            self.pool.get('sale.shop').write(cr, uid, [external_session.sync_from_object.id], {
+                'last_full_stock_resync_date': datetime.now().strftime(DEFAULT_SERVER_DATETIME_FORMAT)}, context=context)
         return True
 
 
+class prestashop_stock_level(osv.osv):
+    _name = 'prestashop.stock.level'
+    _description = 'Stock level pushed to a PrestaShop shop'
+
+    _columns = {
+        'product_id': fields.many2one('product.product', 'Product', required=True, ondelete='cascade', select=True),
+        'shop_id': fields.many2one('sale.shop', 'Shop', required=True, ondelete='cascade', select=True),
+        'quantity': fields.integer('Quantity'),
+    }
+
+    _sql_constraints = [
+        ('product_shop_uniq', 'unique(product_id, shop_id)', 'The stock level of a product must be unique per shop!'),
+    ]
+
+
 class product_category(osv.osv):
     _inherit='product.category'
 
@@ -24,10 +24,67 @@
 from osv import osv, fields
 from tools.translate import _
 from prestapyt import PrestaShopWebServiceError
+from id_map import remove_from_id_maps
+from export_digest import compute_digest
+from prestashop_osv import session_cache
 import logging
 
 _logger = logging.getLogger(__name__)
 
+
+class ImageInventory(object):
+    """Images of the products (or of the categories) in PrestaShop. The list
+    of the owners which have images is read once per export, the images of
+    an owner are read once, then both are updated when images are deleted
+    or added, instead of listing them for each exported image"""
+
+    def __init__(self, connection, image_resource):
+        self.connection = connection
+        self.image_resource = image_resource
+        self._owner_ids = None
+        self._image_ids = {}
+
+    def get_owner_ids(self):
+        if self._owner_ids is None:
+            self._owner_ids = set(self.connection.search(self.image_resource) or [])
+        return self._owner_ids
+
+    def has_image(self, owner_id, image_id=None):
+        """Return True if the owner has an image (the image image_id if given)"""
+        if owner_id not in self.get_owner_ids():
+            return False
+        if image_id is None:
+            return True
+        if owner_id not in self._image_ids:
+            # I can't search directly in /api/images/products/ID when the
+            # product has no image (error 500), this is why the owners are
+            # checked first
+            self._image_ids[owner_id] = set(self.connection.search('%s/%s' % (self.image_resource, owner_id)) or [])
+        return image_id in self._image_ids[owner_id]
+
+    def remove(self, owner_id, image_id=None):
+        if image_id is None or (owner_id in self._image_ids and self._image_ids[owner_id] == set([image_id])):
+            self.get_owner_ids().discard(owner_id)
+            self._image_ids.pop(owner_id, None)
+        elif owner_id in self._image_ids:
+            self._image_ids[owner_id].discard(image_id)
+
+    def add(self, owner_id, image_id=None):
+        if owner_id not in self.get_owner_ids():
+            self.get_owner_ids().add(owner_id)
+            self._image_ids[owner_id] = set()
+        if image_id is not None and owner_id in self._image_ids:
+            self._image_ids[owner_id].add(image_id)
+
+
+def get_image_inventory(external_session, image_resource):
+    """Return the ImageInventory of the session for the given image resource
+    (ex: 'images/products')"""
+    inventories = session_cache(external_session, 'image_inventory')
+    if image_resource not in inventories:
+        inventories[image_resource] = ImageInventory(external_session.connection, image_resource)
+    return inventories[image_resource]
+
 class product_images(osv.osv):
     _inherit = "product.images"
 
@@ -56,29 +113,33 @@ class product_images(osv.osv):
             raise osv.except_osv(_('Error'), _("Missing filename on image ID %d" % resource_id))
 
         _logger.info("Start call_prestashop_method for product.images with method '%s' for resource_id '%d'" % (method, resource_id))
+        # Don't send again an image which didn't change since its last export
+        digest_obj = self.pool.get('prestashop.export.digest')
+        image_digest = compute_digest(str(resource['image'].get('product_id')), img_filename, resource['image'].get('image_binary'))
+        if method == 'edit' and image_digest == digest_obj.get_digest(cr, uid, self._name, resource_id,
+                                                external_session.referential_id.id, 'image', context=context):
+            _logger.info("Image %s didn't change since its last export, skipped" % img_filename)
+            return resource['image'].get('id')
+        image_inventory = get_image_inventory(external_session, mapping[mapping_id]['external_resource_name'])
         if method == 'edit':
             ps_method = mapping[mapping_id]['external_update_method'] or method
             # Delete image if it already exists in PS
-            # If can't search directly in /api/images/products/ID, because I get
-            # a 500 error if the product has no image
-            # So i have to search first on /apt/images/products/
-            ps_product_with_image_ids = external_session.connection.search(mapping[mapping_id]['external_resource_name'])
-            if resource['image'].get('product_id') in ps_product_with_image_ids:
-                ps_product_image_ids = external_session.connection.search(mapping[mapping_id]['external_resource_name'] + '/' + str(resource['image'].get('product_id')))
-                if ps_product_image_ids and resource['image'].get('id') in ps_product_image_ids:
-                    _logger.info("Deleting image PS ID %d for product PS ID %d" % (resource['image'].get('id'), resource['image'].get('product_id')))
-                    external_session.connection.delete(mapping[mapping_id]['external_resource_name'] + '/' + str(resource['image'].get('product_id')), resource['image'].get('id'))
-                    model_data_obj = self.pool.get('ir.model.data')
-                    model_data_id_to_delete = model_data_obj.search(cr, uid, [
-                        ('name', '=', self.prefixed_id(resource['image'].get('id'))),
-                        ('model', '=', self._name),
-                        ('referential_id', '=', external_session.referential_id.id)
-                        ], context=context)
-                    if len(model_data_id_to_delete) != 1:
-                        raise
-                    else:
-                        _logger.info('Deleting ir_model_data corresponding to image PS ID %d' % resource['image'].get('id'))
-                        model_data_obj.unlink(cr, uid, model_data_id_to_delete, context=context)
+            if image_inventory.has_image(resource['image'].get('product_id'), resource['image'].get('id')):
+                _logger.info("Deleting image PS ID %d for product PS ID %d" % (resource['image'].get('id'), resource['image'].get('product_id')))
+                external_session.connection.delete(mapping[mapping_id]['external_resource_name'] + '/' + str(resource['image'].get('product_id')), resource['image'].get('id'))
+                image_inventory.remove(resource['image'].get('product_id'), resource['image'].get('id'))
+                model_data_obj = self.pool.get('ir.model.data')
+                model_data_id_to_delete = model_data_obj.search(cr, uid, [
+                    ('name', '=', self.prefixed_id(resource['image'].get('id'))),
+                    ('model', '=', self._name),
+                    ('referential_id', '=', external_session.referential_id.id)
+                    ], context=context)
+                if len(model_data_id_to_delete) != 1:
+                    raise
+                else:
+                    _logger.info('Deleting ir_model_data corresponding to image PS ID %d' % resource['image'].get('id'))
+                    model_data_obj.unlink(cr, uid, model_data_id_to_delete, context=context)
+                    remove_from_id_maps(cr.dbname, self._name, external_session.referential_id.id, resource['image'].get('id'))
 
         _logger.info('Pushing product image %s from OE to PrestaShop product ID %d' % (img_filename, resource['image'].get('product_id')))
 
@@ -88,6 +149,9 @@ class product_images(osv.osv):
             if method == 'edit':
                 # I recreate the mapping
                 self.create_external_id_vals(cr, uid, resource_id, res, external_session.referential_id.id, context=context)
+            if res:
+                image_inventory.add(resource['image'].get('product_id'), int(res))
+            digest_obj.set_digest(cr, uid, self._name, resource_id, external_session.referential_id.id, 'image', image_digest, context=context)
         except PrestaShopWebServiceError, e:
             _logger.warning("PrestaShop webservice answered an error. HTTP error code: %s, PrestaShop error code: %s, PrestaShop error message: %s" % (e.error_code, e.ps_error_code, e.ps_error_msg))
             raise osv.except_osv(_('PrestaShop Webservice Error:'), e.ps_error_msg)
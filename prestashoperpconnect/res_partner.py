@@ -26,6 +26,15 @@ from openerp.osv import fields
 from base_external_referentials.decorator import only_for_referential
 from datetime import datetime
 from openerp.tools import DEFAULT_SERVER_DATETIME_FORMAT
+from openerp.tools.config import config
+from worker_pool import run_in_worker_pool
+import logging
+
+_logger = logging.getLogger(__name__)
+
+# Number of referentials whose customers are imported at the same time by
+# the scheduler, unless the option prestashop_import_workers is set
+IMPORT_WORKERS = 4
 
 class res_partner(Model):
     _inherit = 'res.partner'
@@ -40,18 +49,21 @@ class res_partner(Model):
     }
 
     @only_for_referential('prestashop')
-    def _get_external_resources(self, cr, uid, external_session, external_id=None, resource_filter=None, mapping=None, fields=None, context=None):
-        result = super(res_partner, self)._get_external_resources(cr, uid, external_session, external_id=external_id, resource_filter=resource_filter, mapping=mapping, fields=fields, context=context)
-        main_contact = {'contact_type': 'default'}
-        if result and result[0]:
-            email = result[0].get('email', False) or ''
+    def _process_external_resources(self, cr, uid, external_session, resources, context=None):
+        result = super(res_partner, self)._process_external_resources(cr, uid, external_session, resources, context=context)
+        # When the customers are read by page, the result contains one dict per customer
+        for customer in result:
+            if not customer:
+                continue
+            main_contact = {'contact_type': 'default'}
+            email = customer.get('email', False) or ''
             if email:
                 main_contact.update({'email': email})
-            name = result[0].get('firstname', False) or ''
-            name += (result[0].get('lastname', False) and ' ' + result[0].get('lastname', False)) or ''
+            name = customer.get('firstname', False) or ''
+            name += (customer.get('lastname', False) and ' ' + customer.get('lastname', False)) or ''
             if name:
                 main_contact.update({'contact_name': name})
-            result[0]['main_contact'] = [main_contact]
+            customer['main_contact'] = [main_contact]
         return result
 
     def _get_last_imported_date(self, cr, uid, external_session, context=None):
@@ -68,25 +80,64 @@ class res_partner(Model):
                                                     context=context)
         return True
 
-    def run_scheduled_import_customers(self, cr, uid, context=None):
+    def _get_last_imported_id(self, cr, uid, external_session, context=None):
+        ext_ref_browse = self.pool.get('external.referential').browse(cr,
+                                    uid, [external_session.referential_id.id], context=context)[0]
+        return ext_ref_browse.last_customer_import_id
+
+    def _set_last_imported_id(self, cr, uid, external_session, last_id, context=None):
+        self.pool.get('external.referential').write(cr, uid, [external_session.referential_id.id],
+                                                    {'last_customer_import_id': last_id or 0},
+                                                    context=context)
+        return True
+
+    def _get_resumed_import_date(self, cr, uid, external_session, context=None):
+        ext_ref_browse = self.pool.get('external.referential').browse(cr,
+                                    uid, [external_session.referential_id.id], context=context)[0]
+        return ext_ref_browse.last_customer_import_start
+
+    def _set_resumed_import_date(self, cr, uid, external_session, date, context=None):
+        self.pool.get('external.referential').write(cr, uid, [external_session.referential_id.id],
+                                                    {'last_customer_import_start': date},
+                                                    context=context)
+        return True
+
+    def run_scheduled_import_customers(self, cr, uid, pool_size=None, context=None):
         """
          - search 'external referentials' that must trigger customers import
             (according to prestashop's referential type)
-         - trigger import from each referential
-        :rtype: boolean
-        :return: True when import(s) is ended
+         - trigger import from each referential, in a pool of workers : each
+            referential is imported with its own cursor and transaction, so a
+            slow or failing shop doesn't delay or roll back the other ones
+        :param int pool_size: number of referentials imported at the same time
+        :rtype: dict
+        :return: {referential id: error message or False} when import(s) is ended
         """
         if context is None:
             context = {}
+        if pool_size is None:
+            pool_size = int(config.get('prestashop_import_workers', IMPORT_WORKERS))
         search_vals = [('code', '=', 'prestashop')]
         type_ext_refs = self.pool.get('external.referential.type').search(cr, uid, search_vals)
         search_vals = [('type_id', 'in', tuple(type_ext_refs))]
         ext_ref_model = self.pool.get('external.referential')
         ext_refs = ext_ref_model.search(cr, uid, search_vals)
 
-        ext_ref_model.import_customers(cr, uid, ext_refs, context=context)
+        def import_customers(worker_cr, referential_id):
+            # each worker has its own context, the imports modify it (lang)
+            return ext_ref_model.import_customers(worker_cr, uid, [referential_id], context=dict(context))
 
-        return True
+        results = run_in_worker_pool(cr.dbname, ext_refs, import_customers, pool_size)
+        errors = {}
+        for referential_id, (error, res) in results.items():
+            if error:
+                _logger.error("The scheduled import of the customers of the referential ID %s failed: %s"
+                              % (referential_id, error))
+            else:
+                _logger.info("The scheduled import of the customers of the referential ID %s is done"
+                             % referential_id)
+            errors[referential_id] = error
+        return errors
 
 class res_partner_address(Model):
     _inherit = 'res.partner.address'
@@ -156,4 +207,26 @@ class res_partner_address(Model):
             {'last_customer_address_import_date': new_date}, context=context)
         return True
 
+    def _get_last_imported_id(self, cr, uid, external_session, context=None):
+        ext_ref_browse = self.pool.get('external.referential').browse(cr,
+                                    uid, [external_session.referential_id.id], context=context)[0]
+        return ext_ref_browse.last_customer_address_import_id
+
+    def _set_last_imported_id(self, cr, uid, external_session, last_id, context=None):
+        self.pool.get('external.referential').write(cr, uid,
+            [external_session.referential_id.id],
+            {'last_customer_address_import_id': last_id or 0}, context=context)
+        return True
+
+    def _get_resumed_import_date(self, cr, uid, external_session, context=None):
+        ext_ref_browse = self.pool.get('external.referential').browse(cr,
+                                    uid, [external_session.referential_id.id], context=context)[0]
+        return ext_ref_browse.last_customer_address_import_start
+
+    def _set_resumed_import_date(self, cr, uid, external_session, date, context=None):
+        self.pool.get('external.referential').write(cr, uid,
+            [external_session.referential_id.id],
+            {'last_customer_address_import_start': date}, context=context)
+        return True
+
 
@@ -23,10 +23,33 @@
 ###############################################################################
 
 from osv import osv, fields
-from base_external_referentials.decorator import only_for_referential, catch_action, commit_now
-from base_external_referentials.external_osv import ExternalSession
-from datetime import datetime
+from base_external_referentials.decorator import only_for_referential, commit_now
+from datetime import datetime, timedelta
+from openerp.tools import DEFAULT_SERVER_DATETIME_FORMAT
+from openerp.tools.config import config
+from prestashop_osv import session_cache
+from worker_pool import run_with_own_cursor
+import heapq
+import threading
+import Queue
+import logging
 
+_logger = logging.getLogger(__name__)
+
+# Number of shops whose orders are imported at the same time by the
+# scheduler, unless the option prestashop_order_import_workers is set
+ORDER_IMPORT_WORKERS = 4
+
+# Duration (s) of a run of the orders import scheduler : the busy shops are
+# polled several times during a run
+SCHEDULER_RUN_TIME = 50
+
+# Number of polls whose new orders are kept to adapt the poll interval
+POLL_HISTORY = 5
+
+# The poll interval of a shop is halved when its last polls returned more
+# orders than this on average, and doubled when they returned none
+BUSY_ORDERS_PER_POLL = 1
 
 
 #TODO improve me, this should be not hardcoded. Need to syncronize prestashop state in OpenERP
@@ -37,12 +60,185 @@ PRESTASHOP_MAP_STATE = {
 
 }
 
+class sale_shop(osv.osv):
+    _inherit = 'sale.shop'
+
+    _columns = {
+        'import_orders_from_id': fields.integer('Resume Orders Import After ID',
+                help="Set when an import of orders is interrupted, the next import starts after this PrestaShop order ID"),
+        'import_orders_start_date': fields.datetime('Interrupted Orders Import Start',
+                help="Date of the beginning of the interrupted import of orders, kept when it is resumed"),
+        'export_changed_stock_only': fields.boolean('Export Changed Stock Only',
+                help="If checked, the stock export only pushes the products whose quantity changed since they were last pushed to this shop"),
+        'stock_full_resync_interval': fields.integer('Full Stock Resync (days)',
+                help="Only used when the changed stock only is exported. Every this number of days, the stock export pushes all the quantities, so the shop is corrected if its stock drifted. 0 to never do it automatically"),
+        'last_full_stock_resync_date': fields.datetime('Last Full Stock Resync', readonly=True),
+        'order_poll_min_interval': fields.integer('Min Orders Poll Interval (s)',
+                help="Shortest interval between two imports of the orders by the scheduler, used when the shop is busy"),
+        'order_poll_max_interval': fields.integer('Max Orders Poll Interval (s)',
+                help="Longest interval between two imports of the orders by the scheduler, used when the shop is quiet"),
+        'order_poll_interval': fields.integer('Orders Poll Interval (s)', readonly=True,
+                help="Set by the orders import scheduler from the number of orders returned by the last imports"),
+        'next_order_poll': fields.datetime('Next Orders Poll', readonly=True),
+        'last_order_poll_counts': fields.char('Orders of the Last Polls', size=64, readonly=True,
+                help="Number of new orders returned by the last imports of the scheduler, the most recent last"),
+    }
+
+    _defaults = {
+        'export_changed_stock_only': True,
+        'stock_full_resync_interval': 7,
+        'order_poll_min_interval': 60,
+        'order_poll_max_interval': 3600,
+        'order_poll_interval': 300,
+    }
+
+    def export_all_inventory(self, cr, uid, ids, context=None):
+        """Push the stock levels of all the products, even the ones which
+        didn't change since their last push"""
+        context = dict(context or {}, export_all_stock=True)
+        return self.export_inventory(cr, uid, ids, context=context)
+
+    def _get_scheduled_shop_ids(self, cr, uid, context=None):
+        type_ids = self.pool.get('external.referential.type').search(cr, uid, [('code', '=', 'prestashop')], context=context)
+        return self.search(cr, uid, [('referential_id.type_id', 'in', type_ids)], context=context)
+
+    def _compute_order_poll_interval(self, cr, uid, shop, counts, context=None):
+        """Return the next poll interval of a shop from the number of new
+        orders returned by its last polls : halved when the shop is busy,
+        doubled when it is quiet"""
+        min_interval = shop.order_poll_min_interval or 60
+        max_interval = max(shop.order_poll_max_interval or 3600, min_interval)
+        interval = shop.order_poll_interval or min_interval
+        if counts and float(sum(counts)) / len(counts) > BUSY_ORDERS_PER_POLL:
+            interval = interval / 2
+        elif not sum(counts):
+            interval = interval * 2
+        return max(min_interval, min(interval, max_interval))
+
+    def _plan_order_poll(self, cr, uid, shop_id, new_orders, context=None):
+        """Save the number of new orders returned by a poll of the shop and
+        plan its next poll. When the poll failed (new_orders is None), the
+        next poll is only delayed
+        :return: date of the next poll
+        :rtype: datetime
+        """
+        shop = self.browse(cr, uid, shop_id, context=context)
+        counts = [int(count) for count in (shop.last_order_poll_counts or '').split(',') if count]
+        if new_orders is None:
+            interval = min((shop.order_poll_interval or 60) * 2, max(shop.order_poll_max_interval or 3600, 60))
+        else:
+            counts = (counts + [new_orders])[-POLL_HISTORY:]
+            interval = self._compute_order_poll_interval(cr, uid, shop, counts, context=context)
+        next_poll = datetime.utcnow() + timedelta(seconds=interval)
+        self.write(cr, uid, [shop_id], {
+            'order_poll_interval': interval,
+            'next_order_poll': next_poll.strftime(DEFAULT_SERVER_DATETIME_FORMAT),
+            'last_order_poll_counts': ','.join([str(count) for count in counts]),
+        }, context=context)
+        return next_poll
+
+    def _poll_orders(self, cr, uid, shop_id, context=None):
+        """Import the new orders of the shop and plan its next poll
+        :return: date of the next poll
+        :rtype: datetime
+        """
+        cr.execute("SELECT max(id) FROM sale_order WHERE shop_id = %s", (shop_id,))
+        last_order_id = cr.fetchone()[0] or 0
+        self.import_orders(cr, uid, [shop_id], context=context)
+        cr.execute("SELECT count(*) FROM sale_order WHERE shop_id = %s AND id > %s", (shop_id, last_order_id))
+        new_orders = cr.fetchone()[0]
+        return self._plan_order_poll(cr, uid, shop_id, new_orders, context=context)
+
+    def run_order_import_scheduler(self, cr, uid, max_concurrency=None, run_time=SCHEDULER_RUN_TIME, context=None):
+        """Import the orders of the PrestaShop shops when their next poll is
+        due, the most late first, with at most max_concurrency shops at the
+        same time. Each poll runs with its own cursor and transaction, and
+        plans the next poll of its shop from the orders it returned, so the
+        busy shops are polled again during the run. Called by the cron
+        :param int max_concurrency: number of shops imported at the same time
+        :param int run_time: no poll is started after this number of seconds
+        :rtype: dict
+        :return: {shop id: error message of its last poll or False}
+        """
+        if max_concurrency is None:
+            max_concurrency = int(config.get('prestashop_order_import_workers', ORDER_IMPORT_WORKERS))
+        max_concurrency = max(max_concurrency, 1)
+        shop_ids = self._get_scheduled_shop_ids(cr, uid, context=context)
+        # the poll dates are in UTC, like the ones of the order states outbox
+        now = datetime.utcnow()
+        end = now + timedelta(seconds=run_time)
+        # priority queue of the tuples (next poll date, shop id)
+        queue = []
+        for shop in self.read(cr, uid, shop_ids, ['next_order_poll'], context=context):
+            next_poll = now
+            if shop['next_order_poll']:
+                next_poll = datetime.strptime(shop['next_order_poll'], DEFAULT_SERVER_DATETIME_FORMAT)
+            heapq.heappush(queue, (next_poll, shop['id']))
+
+        dbname = cr.dbname
+        done = Queue.Queue()
+        def poll(shop_id):
+            # each poll has its own context, the imports modify it (lang)
+            error, next_poll = run_with_own_cursor(dbname,
+                    lambda worker_cr, shop_id: self._poll_orders(worker_cr, uid, shop_id, context=dict(context or {})), shop_id)
+            if error:
+                next_poll = run_with_own_cursor(dbname,
+                    lambda worker_cr, shop_id: self._plan_order_poll(worker_cr, uid, shop_id, None, context=dict(context or {})), shop_id)[1]
+            done.put((shop_id, error, next_poll))
+
+        results = {}
+        running = 0
+        while True:
+            now = datetime.utcnow()
+            timeout = None
+            if now >= end:
+                # no poll is started anymore, the shops still due are polled
+                # by the next run
+                if not running:
+                    break
+            else:
+                while queue and running < max_concurrency and queue[0][0] <= now:
+                    next_poll, shop_id = heapq.heappop(queue)
+                    worker = threading.Thread(target=poll, args=(shop_id,))
+                    worker.start()
+                    running += 1
+                if not running and (not queue or queue[0][0] >= end):
+                    break
+                # wait for the end of a poll, or for the next due shop
+                if queue and running < max_concurrency:
+                    timeout = max((min(queue[0][0], end) - now).total_seconds(), 0.1)
+            try:
+                shop_id, error, next_poll = done.get(timeout=timeout)
+            except Queue.Empty:
+                continue
+            running -= 1
+            if error:
+                _logger.error("The scheduled import of the orders of the shop ID %s failed: %s" % (shop_id, error))
+            results[shop_id] = error
+            if next_poll:
+                heapq.heappush(queue, (next_poll, shop_id))
+        return results
+
+
 class sale_order_line(osv.osv):
     _inherit = 'sale.order.line'
 
+    def _prefetch_so_lines_details(self, cr, uid, external_session, ps_order_row_ids, context=None):
+        """Read all the given order rows with batched requests and keep them
+        on the external session, so _get_so_line_details doesn't have
+        to do one request per order row"""
+        prefetched = session_cache(external_session, 'order_details')
+        ps_order_row_ids = [int(x) for x in ps_order_row_ids if int(x) not in prefetched]
+        if ps_order_row_ids:
+            prefetched.update(self._get_external_resources_by_ids(cr, uid, external_session,
+                                            'order_details', ps_order_row_ids, context=context))
+        return True
+
     def _get_so_line_details(self, cr, uid, external_session, ps_order_row_id, context=None):
         """This function is designed to be inherited !"""
-
+        prefetched = session_cache(external_session, 'order_details')
+        if int(ps_order_row_id) in prefetched:
+            return prefetched.pop(int(ps_order_row_id))
         return self._get_external_resources(cr, uid, external_session, ps_order_row_id, context=context)
 
 
@@ -52,17 +248,19 @@ class sale_order(osv.osv):
 
 
     @only_for_referential('prestashop')
-    def _get_external_resources(self, cr, uid, external_session, external_id=None, resource_filter=None, mapping=None, fields=None, context=None):
-        result = super(sale_order, self)._get_external_resources(cr, uid, external_session, \
-                                            external_id=external_id, resource_filter=resource_filter, \
-                                            mapping=mapping, fields=fields, context=context)
+    def _process_external_resources(self, cr, uid, external_session, resources, context=None):
+        result = super(sale_order, self)._process_external_resources(cr, uid, external_session, resources, context=context)
+        sale_line_obj = self.pool.get('sale.order.line')
+        for order in result:
+            if not isinstance(order['order_rows'], list):
+                order['order_rows'] = [order['order_rows']]
+        # Read the rows of all the orders at once
+        all_order_rows_ids = [order_row_id for order in result for order_row_id in order['order_rows']]
+        sale_line_obj._prefetch_so_lines_details(cr, uid, external_session, all_order_rows_ids, context=context)
         for order in result:
-            order_rows_ids = order['order_rows']
             order_rows_details = []
-            if not isinstance(order_rows_ids, list):
-                order_rows_ids = [order_rows_ids]
-            for order_row_id in order_rows_ids:
-                order_rows_details += self.pool.get('sale.order.line')._get_so_line_details(cr, uid, external_session, order_row_id, context=context)
+            for order_row_id in order['order_rows']:
+                order_rows_details += sale_line_obj._get_so_line_details(cr, uid, external_session, order_row_id, context=context)
             order['order_rows'] = order_rows_details
         return result
 
@@ -81,6 +279,30 @@ class sale_order(osv.osv):
             [external_session.sync_from_object.id], {'import_orders_from_date': new_date }, context=context)
         return True
 
+    @commit_now
+    def _get_last_imported_id(self, cr, uid, external_session, context=None):
+        sale_shop_browse = self.pool.get('sale.shop').browse(cr,
+                                    uid, [external_session.sync_from_object.id], context=context)[0]
+        return sale_shop_browse.import_orders_from_id
+
+    @commit_now
+    def _set_last_imported_id(self, cr, uid, external_session, last_id, context=None):
+        self.pool.get('sale.shop').write(cr, uid,
+            [external_session.sync_from_object.id], {'import_orders_from_id': last_id or 0}, context=context)
+        return True
+
+    @commit_now
+    def _get_resumed_import_date(self, cr, uid, external_session, context=None):
+        sale_shop_browse = self.pool.get('sale.shop').browse(cr,
+                                    uid, [external_session.sync_from_object.id], context=context)[0]
+        return sale_shop_browse.import_orders_start_date
+
+    @commit_now
+    def _set_resumed_import_date(self, cr, uid, external_session, date, context=None):
+        self.pool.get('sale.shop').write(cr, uid,
+            [external_session.sync_from_object.id], {'import_orders_start_date': date}, context=context)
+        return True
+
     def _get_payment_information(self, cr, uid, external_session, order_id, resource, context=None):
         """
         Parse the external resource and return a dict of data converted
@@ -90,26 +312,18 @@ class sale_order(osv.osv):
         vals['amount'] = float(resource['total_paid_real'])
         return vals
 
-    @catch_action
-    def _update_state_in_prestashop(self, cr, uid, sale_id, state, context=None):
-        sale = self.browse(cr, uid, sale_id, context=context)
-        external_session = ExternalSession(sale.shop_id.referential_id)
-        ext_id = self.get_extid(cr, uid, sale_id, external_session.referential_id.id, context=context)
-        if PRESTASHOP_MAP_STATE.get(state):
-            external_session.connection.add('order_histories', {'order_history':{
-                'id_order': ext_id,
-                'id_order_state' : PRESTASHOP_MAP_STATE[state]
-                }})
-        return True
-
     def write(self, cr, uid, ids, vals, context=None):
+        """The new state of the PrestaShop orders is saved in the outbox,
+        the cron of the outbox pushes it to PrestaShop"""
         res = super(sale_order, self).write(cr, uid, ids, vals.copy(), context=context)
         if isinstance(ids, (int, long)):
             ids = [ids]
-        if 'state' in vals:
+        if 'state' in vals and PRESTASHOP_MAP_STATE.get(vals['state']):
+            order_states = []
             for sale in self.browse(cr, uid, ids, context=context):
                 if sale.shop_id.type_name and sale.shop_id.type_name.lower() == 'prestashop':
-                    self._update_state_in_prestashop(cr, uid, sale.id, vals['state'], context=context)
+                    order_states.append((sale.id, sale.shop_id.referential_id.id, PRESTASHOP_MAP_STATE[vals['state']]))
+            self.pool.get('prestashop.order.state.outbox').enqueue(cr, uid, order_states, context=context)
         return res
 
 # vim:expandtab:smartindent:tabstop=4:softtabstop=4:shiftwidth=4:
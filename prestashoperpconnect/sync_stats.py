@@ -0,0 +1,165 @@
+# -*- encoding: utf-8 -*-
+###############################################################################
+#                                                                             #
+#   Prestashoperpconnect for OpenERP                                          #
+#   Copyright (C) 2012 Akretion                                               #
+#                                                                             #
+#   This program is free software: you can redistribute it and/or modify      #
+#   it under the terms of the GNU Affero General Public License as            #
+#   published by the Free Software Foundation, either version 3 of the        #
+#   License, or (at your option) any later version.                           #
+#                                                                             #
+#   This program is distributed in the hope that it will be useful,           #
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of            #
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the             #
+#   GNU Affero General Public License for more details.                       #
+#                                                                             #
+#   You should have received a copy of the GNU Affero General Public License  #
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.     #
+#                                                                             #
+###############################################################################
+
+from osv import osv, fields
+from datetime import datetime, timedelta
+from openerp import pooler
+from openerp.tools import DEFAULT_SERVER_DATETIME_FORMAT
+from instrumentation import CallStats, get_current_stats, set_current_stats
+import functools
+import logging
+import time
+
+_logger = logging.getLogger(__name__)
+
+# Number of days the jobs and their statistics are kept
+SYNC_JOB_RETENTION_DAYS = 30
+
+# Maximum time (ms) to save a job, so saving it never blocks the
+# synchronisation, even if its transaction holds a lock on the referential
+SAVE_JOB_TIMEOUT = 10000
+
+
+def monitor_sync_job(action):
+    """Decorator of the methods (self, cr, uid, external_session, ...) which
+    synchronise resources with PrestaShop : the webservice calls made during
+    the method are counted and saved as a job of the referential, except when
+    the method is called by another monitored method, whose job counts them
+    :param str action: start of the name of the job, ex: 'Import'
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(self, cr, uid, external_session, *args, **kwargs):
+            if get_current_stats() is not None:
+                return func(self, cr, uid, external_session, *args, **kwargs)
+            stats = CallStats()
+            set_current_stats(stats)
+            date_start = datetime.now().strftime(DEFAULT_SERVER_DATETIME_FORMAT)
+            start = time.time()
+            state = 'failed'
+            try:
+                res = func(self, cr, uid, external_session, *args, **kwargs)
+                state = 'done'
+                return res
+            finally:
+                set_current_stats(None)
+                self.pool.get('prestashop.sync.job').save_job(cr, uid, external_session.referential_id.id,
+                        '%s %s' % (action, self._name), date_start, time.time() - start, state, stats)
+        return wrapper
+    return decorator
+
+
+class prestashop_sync_job(osv.osv):
+    _name = 'prestashop.sync.job'
+    _description = 'PrestaShop synchronisation job'
+    _order = 'date_start desc, id desc'
+
+    _columns = {
+        'name': fields.char('Job', size=128, readonly=True),
+        'referential_id': fields.many2one('external.referential', 'Referential', required=True, ondelete='cascade', select=True, readonly=True),
+        'date_start': fields.datetime('Start Date', readonly=True),
+        'duration': fields.float('Duration (s)', readonly=True),
+        'webservice_time': fields.float('Webservice Time (s)', readonly=True,
+                help="Time spent in the webservice calls. It can be greater than the duration when the calls are concurrent"),
+        'openerp_time': fields.float('OpenERP Time (s)', readonly=True,
+                help="Duration of the job minus the time spent in the webservice calls"),
+        'calls': fields.integer('Calls', readonly=True),
+        'errors': fields.integer('Errors', readonly=True),
+        'skipped': fields.integer('Skipped', readonly=True,
+                help="Records not sent because their data didn't change since their last export"),
+        'state': fields.selection([('done', 'Done'), ('failed', 'Failed')], 'State', readonly=True),
+        'stat_ids': fields.one2many('prestashop.sync.stat', 'job_id', 'Webservice Calls', readonly=True),
+    }
+
+    def save_job(self, cr, uid, referential_id, name, date_start, duration, state, stats, context=None):
+        """Save the counters of a job with a new cursor, committed at once,
+        so the failed jobs are kept when their transaction is rolled back.
+        It must never break the synchronisation, the counters are lost if
+        they can't be saved"""
+        calls, errors, webservice_time = stats.get_totals()
+        stat_vals = []
+        for (resource, method), counter in stats.counters.items():
+            vals = dict(counter, resource=resource, method=method, referential_id=referential_id,
+                        date_start=date_start, avg_time=counter['calls'] and counter['total_time'] / counter['calls'] or 0.0)
+            stat_vals.append((0, 0, vals))
+        job_cr = pooler.get_db(cr.dbname).cursor()
+        try:
+            job_cr.execute('SET LOCAL statement_timeout = %s', (SAVE_JOB_TIMEOUT,))
+            job_id = self.create(job_cr, uid, {
+                'name': name,
+                'referential_id': referential_id,
+                'date_start': date_start,
+                'duration': duration,
+                'webservice_time': webservice_time,
+                'openerp_time': max(duration - webservice_time, 0.0),
+                'calls': calls,
+                'errors': errors,
+                'skipped': sum([counter['skipped'] for counter in stats.counters.values()]),
+                'state': state,
+                'stat_ids': stat_vals,
+            }, context=context)
+            job_cr.commit()
+        except Exception:
+            _logger.exception("The webservice statistics of the job '%s' could not be saved" % name)
+            job_cr.rollback()
+            return False
+        finally:
+            job_cr.close()
+        return job_id
+
+    def purge_jobs(self, cr, uid, days=SYNC_JOB_RETENTION_DAYS, context=None):
+        """Delete the jobs started more than the given number of days ago,
+        with their statistics. Called by the cron"""
+        limit = (datetime.now() - timedelta(days=days)).strftime(DEFAULT_SERVER_DATETIME_FORMAT)
+        cr.execute("DELETE FROM prestashop_sync_stat WHERE date_start < %s", (limit,))
+        cr.execute("DELETE FROM prestashop_sync_job WHERE date_start < %s", (limit,))
+        _logger.info("%s PrestaShop synchronisation jobs older than %s days purged" % (cr.rowcount, days))
+        return True
+
+
+class prestashop_sync_stat(osv.osv):
+    _name = 'prestashop.sync.stat'
+    _description = 'Webservice calls of a PrestaShop synchronisation job'
+    _rec_name = 'resource'
+    _order = 'date_start desc, total_time desc'
+
+    _columns = {
+        'job_id': fields.many2one('prestashop.sync.job', 'Job', required=True, ondelete='cascade', select=True, readonly=True),
+        'referential_id': fields.many2one('external.referential', 'Referential', ondelete='cascade', select=True, readonly=True),
+        'date_start': fields.datetime('Start Date', readonly=True),
+        'resource': fields.char('Resource', size=64, readonly=True),
+        'method': fields.char('Method', size=8, readonly=True),
+        'calls': fields.integer('Calls', readonly=True),
+        'errors': fields.integer('Errors', readonly=True),
+        'retries': fields.integer('Retries', readonly=True),
+        'skipped': fields.integer('Skipped', readonly=True,
+                help="Requests not sent because their data didn't change since their last export"),
+        'bytes_sent': fields.integer('Bytes Sent', readonly=True),
+        'bytes_received': fields.integer('Bytes Received', readonly=True),
+        'total_time': fields.float('Total Time (s)', readonly=True),
+        'avg_time': fields.float('Average Time (s)', digits=(16, 3), readonly=True),
+        'max_time': fields.float('Max Time (s)', digits=(16, 3), readonly=True),
+        'hist_50ms': fields.integer('< 50ms', readonly=True),
+        'hist_200ms': fields.integer('< 200ms', readonly=True),
+        'hist_1s': fields.integer('< 1s', readonly=True),
+        'hist_5s': fields.integer('< 5s', readonly=True),
+        'hist_slower': fields.integer('>= 5s', readonly=True),
+    }
@@ -0,0 +1,78 @@
+# -*- encoding: utf-8 -*-
+###############################################################################
+#                                                                             #
+#   Prestashoperpconnect for OpenERP                                          #
+#   Copyright (C) 2012 Akretion                                               #
+#                                                                             #
+#   This program is free software: you can redistribute it and/or modify      #
+#   it under the terms of the GNU Affero General Public License as            #
+#   published by the Free Software Foundation, either version 3 of the        #
+#   License, or (at your option) any later version.                           #
+#                                                                             #
+#   This program is distributed in the hope that it will be useful,           #
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of            #
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the             #
+#   GNU Affero General Public License for more details.                       #
+#                                                                             #
+#   You should have received a copy of the GNU Affero General Public License  #
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.     #
+#                                                                             #
+###############################################################################
+
+from openerp import pooler
+import threading
+import Queue
+import logging
+
+_logger = logging.getLogger(__name__)
+
+
+def run_with_own_cursor(dbname, func, item):
+    """Call func(cr, item) with a new cursor, in its own transaction :
+    committed when the call succeeds, rolled back when it fails
+    :return: tuple (error message or False, result of the call)
+    """
+    cr = pooler.get_db(dbname).cursor()
+    try:
+        try:
+            res = func(cr, item)
+            cr.commit()
+            return False, res
+        except Exception, e:
+            cr.rollback()
+            _logger.exception("The job on %s failed" % (item,))
+            return unicode(e) or e.__class__.__name__, None
+    finally:
+        cr.close()
+
+
+def run_in_worker_pool(dbname, items, func, pool_size):
+    """Call func(cr, item) for each item in a pool of pool_size threads,
+    each call with its own cursor (see run_with_own_cursor). A failed call
+    doesn't stop the other ones
+    :return: dictionary {item: (error message or False, result of the call)}
+    """
+    items_queue = Queue.Queue()
+    for item in items:
+        items_queue.put(item)
+    results = {}
+    results_lock = threading.Lock()
+
+    def work():
+        while True:
+            try:
+                item = items_queue.get_nowait()
+            except Queue.Empty:
+                return
+            res = run_with_own_cursor(dbname, func, item)
+            with results_lock:
+                results[item] = res
+
+    workers = []
+    for i in range(max(min(pool_size, len(items)), 1)):
+        worker = threading.Thread(target=work)
+        worker.start()
+        workers.append(worker)
+    for worker in workers:
+        worker.join()
+    return results
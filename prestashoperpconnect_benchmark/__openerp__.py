@@ -0,0 +1,48 @@
+# -*- encoding: utf-8 -*-
+###############################################################################
+#                                                                             #
+#   Prestashoperpconnect for OpenERP                                          #
+#   Copyright (C) 2012 Camptocamp                                             #
+#   Copyright (C) 2012 Akretion                                               #
+#   Author :                                                                  #
+#           Sébastien BEAU <sebastien.beau@akretion.com>                      #
+#                                                                             #
+#   This program is free software: you can redistribute it and/or modify      #
+#   it under the terms of the GNU Affero General Public License as            #
+#   published by the Free Software Foundation, either version 3 of the        #
+#   License, or (at your option) any later version.                           #
+#                                                                             #
+#   This program is distributed in the hope that it will be useful,           #
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of            #
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the             #
+#   GNU Affero General Public License for more details.                       #
+#                                                                             #
+#   You should have received a copy of the GNU Affero General Public License  #
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.     #
+{
+    "name" : "Prestashop-OpenERP connector - Benchmark",
+    "version" : "0.1",
+    "license": "AGPL-3",
+    "depends" : [
+                 "prestashoperpconnect",
+                ],
+    "author" : "PrestashopERPconnect Core Editors,Odoo Community Association (OCA)",
+    "description": """Measure the throughput of the Prestashop-OpenERP connector without a live shop.
+
+The benchmark starts a local fake PrestaShop webservice which serves generated orders, order details, customers, addresses, products, images and stock levels (plus the shops, languages, countries, currencies, taxes, carriers and groups needed to synchronise a referential), with a configurable latency per request.
+It then creates a new referential on it and runs the real imports (customers, products, orders) and exports (images, stock levels) of the connector, and reports for each of them the records per second, the number of requests per record and the peak memory of the server.
+
+The benchmark creates data in the database (a new referential with the imported records) : run it on a dedicated database.
+The fake webservice can also be started alone with "python fake_webservice.py --help".
+""",
+    "website" : "https://launchpad.net/prestashoperpconnect",
+    "category" : "Generic Modules",
+    "complexity" : "expert",
+    "init_xml" : [],
+    "demo_xml" : [],
+    'update_xml': [
+        'benchmark_view.xml',
+    ],
+    "active": False,
+    "installable": True,
+}
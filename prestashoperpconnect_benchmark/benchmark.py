@@ -0,0 +1,210 @@
+# -*- encoding: utf-8 -*-
+###############################################################################
+#                                                                             #
+#   Prestashoperpconnect for OpenERP                                          #
+#   Copyright (C) 2012 Akretion                                               #
+#                                                                             #
+#   This program is free software: you can redistribute it and/or modify      #
+#   it under the terms of the GNU Affero General Public License as            #
+#   published by the Free Software Foundation, either version 3 of the        #
+#   License, or (at your option) any later version.                           #
+#                                                                             #
+#   This program is distributed in the hope that it will be useful,           #
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of            #
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the             #
+#   GNU Affero General Public License for more details.                       #
+#                                                                             #
+#   You should have received a copy of the GNU Affero General Public License  #
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.     #
+#                                                                             #
+###############################################################################
+
+from osv import osv, fields
+from tools.translate import _
+from resource import getrusage, RUSAGE_SELF
+from fake_webservice import FakePrestaShop, generate_fixtures, start_fake_webservice
+import base64
+import logging
+import time
+
+_logger = logging.getLogger(__name__)
+
+BENCHMARK_KEY = 'BENCHMARK'
+
+# 1x1 transparent PNG, exported as the image of the benchmarked products
+BENCHMARK_IMAGE = base64.b64encode(
+    '\x89PNG\r\n\x1a\n\x00\x00\x00\rIHDR\x00\x00\x00\x01\x00\x00\x00\x01\x08\x06\x00\x00\x00\x1f\x15\xc4\x89'
+    '\x00\x00\x00\rIDATx\x9cc\xf8\x0f\x00\x00\x01\x01\x00\x05\x18\xd8N\x00\x00\x00\x00IEND\xaeB`\x82')
+
+
+class prestashop_benchmark(osv.osv_memory):
+    """Measure the throughput of the connector against a local fake
+    PrestaShop webservice. Each run creates a new referential with the
+    imported data : run it on a dedicated database"""
+    _name = 'prestashop.benchmark'
+    _description = 'PrestaShop connector benchmark'
+
+    _columns = {
+        'nb_customers': fields.integer('Customers', required=True),
+        'nb_products': fields.integer('Products', required=True),
+        'nb_orders': fields.integer('Orders', required=True),
+        'lines_per_order': fields.integer('Lines per Order', required=True),
+        'latency': fields.integer('Latency (ms)', help="Time added to each request by the fake webservice"),
+        'read_by_page': fields.boolean('Read Resources by Page'),
+        'stream_responses': fields.boolean('Stream Pages'),
+        'fetch_workers': fields.integer('Concurrent Requests'),
+        'output_format': fields.selection([('xml', 'XML'), ('json', 'JSON')], 'Output Format', required=True),
+        'result': fields.text('Result', readonly=True),
+        'state': fields.selection([('draft', 'Draft'), ('done', 'Done')], 'State', readonly=True),
+    }
+
+    _defaults = {
+        'nb_customers': 200,
+        'nb_products': 200,
+        'nb_orders': 200,
+        'lines_per_order': 3,
+        'latency': 20,
+        'fetch_workers': 1,
+        'output_format': 'xml',
+        'state': 'draft',
+    }
+
+    def _create_referential(self, cr, uid, wizard, location, context=None):
+        ref_obj = self.pool.get('external.referential')
+        version_id = self.pool.get('ir.model.data').get_object_reference(cr, uid, 'prestashoperpconnect', 'prestashop1500')[1]
+        lang_ids = self.pool.get('res.lang').search(cr, uid, [('code', '=', 'en_US')], context=context)
+        referential_id = ref_obj.create(cr, uid, {
+            'name': 'Benchmark %s' % time.strftime('%Y-%m-%d %H:%M:%S'),
+            'version_id': version_id,
+            'location': location,
+            'apipass': BENCHMARK_KEY,
+            'active_language_ids': [(6, 0, lang_ids)],
+            'read_by_page': wizard.read_by_page,
+            'stream_responses': wizard.stream_responses,
+            'fetch_workers': wizard.fetch_workers,
+            'output_format': wizard.output_format,
+        }, context=context)
+        ref_obj.refresh_mapping(cr, uid, [referential_id], context=context)
+        return referential_id
+
+    def _create_product_images(self, cr, uid, referential_id, context=None):
+        image_obj = self.pool.get('product.images')
+        cr.execute("SELECT res_id FROM ir_model_data WHERE referential_id = %s AND model = 'product.product'",
+                   (referential_id,))
+        for product_id, in cr.fetchall():
+            image_obj.create(cr, uid, {
+                'name': 'benchmark-%s' % product_id,
+                'filename': 'benchmark-%s.png' % product_id,
+                'link': False,
+                'file': BENCHMARK_IMAGE,
+                'product_id': product_id,
+            }, context=context)
+        return True
+
+    def _get_scenarios(self, cr, uid, referential_id, context=None):
+        """Return the measured scenarios, as a list of tuples (name, models
+        whose new external ids are the processed records, function). When no
+        model is given, the processed records are the write requests"""
+        ref_obj = self.pool.get('external.referential')
+        shop_obj = self.pool.get('sale.shop')
+        shop_ids = shop_obj.search(cr, uid, [('referential_id', '=', referential_id)], context=context)
+        return [
+            (_('Customers import'), ['res.partner', 'res.partner.address'],
+                lambda: ref_obj.import_customers(cr, uid, [referential_id], context=context)),
+            (_('Products import'), ['product.product'],
+                lambda: ref_obj.import_products(cr, uid, [referential_id], context=context)),
+            (_('Orders import'), ['sale.order'],
+                lambda: shop_obj.import_orders(cr, uid, shop_ids, context=context)),
+            (_('Images export'), ['product.images'],
+                lambda: ref_obj.export_resources(cr, uid, [referential_id], 'product.images', context=context)),
+            (_('Stock export'), [],
+                lambda: shop_obj.export_inventory(cr, uid, shop_ids, context=context)),
+        ]
+
+    def _count_records(self, cr, uid, referential_id, models, stats):
+        if not models:
+            return sum([count for (method, resource), count in stats['requests'].items()
+                        if method in ('PUT', 'POST')])
+        cr.execute("SELECT count(*) FROM ir_model_data WHERE referential_id = %s AND model IN %s",
+                   (referential_id, tuple(models)))
+        return cr.fetchone()[0]
+
+    def _run_scenario(self, cr, uid, prestashop, referential_id, name, models, function, context=None):
+        stats_before = prestashop.stats.snapshot()
+        records_before = self._count_records(cr, uid, referential_id, models, stats_before)
+        error = False
+        start = time.time()
+        try:
+            function()
+            cr.commit()
+        except Exception, e:
+            _logger.exception("Benchmark scenario '%s' failed" % name)
+            cr.rollback()
+            error = unicode(e)
+        duration = time.time() - start
+        stats_after = prestashop.stats.snapshot()
+        records = self._count_records(cr, uid, referential_id, models, stats_after) - records_before
+        requests = sum(stats_after['requests'].values()) - sum(stats_before['requests'].values())
+        return {
+            'name': name,
+            'records': records,
+            'duration': duration,
+            'requests': requests,
+            'bytes': stats_after['bytes_sent'] - stats_before['bytes_sent'],
+            # peak resident memory of the server process, in MB
+            'peak_memory': getrusage(RUSAGE_SELF).ru_maxrss / 1024.0,
+            'error': error,
+        }
+
+    def _format_results(self, results):
+        lines = ['%-18s %8s %8s %10s %9s %11s %10s %9s' % (_('Scenario'), _('Records'), _('Seconds'),
+                    _('Records/s'), _('Requests'), _('Req/record'), _('KB sent'), _('Peak MB'))]
+        for res in results:
+            lines.append('%-18s %8d %8.2f %10.2f %9d %11.2f %10d %9.1f' % (
+                res['name'], res['records'], res['duration'],
+                res['duration'] and res['records'] / res['duration'] or 0.0,
+                res['requests'], res['records'] and float(res['requests']) / res['records'] or 0.0,
+                res['bytes'] / 1024, res['peak_memory']))
+            if res['error']:
+                lines.append('    %s %s' % (_('Error:'), res['error']))
+        return '\n'.join(lines)
+
+    def run_benchmark(self, cr, uid, ids, context=None):
+        """Start the fake webservice, synchronise a new referential with it
+        and measure each scenario. The data is committed after each scenario
+        because the imports commit their progress with other cursors"""
+        if isinstance(ids, (int, long)):
+            ids = [ids]
+        wizard = self.browse(cr, uid, ids[0], context=context)
+        fixtures = generate_fixtures(wizard.nb_customers, wizard.nb_products, wizard.nb_orders, wizard.lines_per_order)
+        prestashop = FakePrestaShop(fixtures, api_key=BENCHMARK_KEY, latency=(wizard.latency or 0) / 1000.0)
+        server = start_fake_webservice(prestashop)
+        try:
+            ref_obj = self.pool.get('external.referential')
+            referential_id = self._create_referential(cr, uid, wizard, server.location, context=context)
+            cr.commit()
+            def setup():
+                ref_obj.import_referentials(cr, uid, [referential_id], context=context)
+                ref_obj.import_base_objects(cr, uid, [referential_id], context=context)
+                ref_obj.import_customer_groups(cr, uid, [referential_id], context=context)
+                ref_obj.import_product_categories(cr, uid, [referential_id], context=context)
+            results = [self._run_scenario(cr, uid, prestashop, referential_id, _('Setup'), [], setup, context=context)]
+            for name, models, function in self._get_scenarios(cr, uid, referential_id, context=context):
+                if models == ['product.images']:
+                    self._create_product_images(cr, uid, referential_id, context=context)
+                    cr.commit()
+                results.append(self._run_scenario(cr, uid, prestashop, referential_id, name, models, function, context=context))
+        finally:
+            server.shutdown()
+            server.server_close()
+        result = self._format_results(results)
+        _logger.info("PrestaShop connector benchmark :\n%s" % result)
+        self.write(cr, uid, ids, {'result': result, 'state': 'done'}, context=context)
+        return {
+            'type': 'ir.actions.act_window',
+            'res_model': self._name,
+            'res_id': ids[0],
+            'view_type': 'form',
+            'view_mode': 'form',
+            'target': 'new',
+        }
@@ -0,0 +1,578 @@
+# -*- encoding: utf-8 -*-
+###############################################################################
+#                                                                             #
+#   Prestashoperpconnect for OpenERP                                          #
+#   Copyright (C) 2012 Akretion                                               #
+#                                                                             #
+#   This program is free software: you can redistribute it and/or modify      #
+#   it under the terms of the GNU Affero General Public License as            #
+#   published by the Free Software Foundation, either version 3 of the        #
+#   License, or (at your option) any later version.                           #
+#                                                                             #
+#   This program is distributed in the hope that it will be useful,           #
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of            #
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the             #
+#   GNU Affero General Public License for more details.                       #
+#                                                                             #
+#   You should have received a copy of the GNU Affero General Public License  #
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.     #
+#                                                                             #
+###############################################################################
+
+"""Local stand-in for the PrestaShop 1.5 webservice, serving generated
+resources with a configurable latency. It can be started alone :
+
+    python fake_webservice.py --port 8069 --orders 500 --latency 0.05
+
+and then used as the location of a referential (any webservice key)"""
+
+import BaseHTTPServer
+import SocketServer
+import base64
+import gzip
+import json
+import random
+import re
+import threading
+import time
+import urllib
+import urlparse
+from cStringIO import StringIO
+from xml.sax.saxutils import escape
+try:
+    from xml.etree import cElementTree as ElementTree
+except ImportError:
+    from xml.etree import ElementTree
+
+PSWS_VERSION = '1.5.4.1'
+
+SINGULAR_NAMES = {
+    'addresses': 'address',
+    'categories': 'category',
+    'countries': 'country',
+    'currencies': 'currency',
+    'order_histories': 'order_history',
+    'taxes': 'tax',
+}
+
+# Fields rendered in XML with a link to the resource they refer to, like
+# PrestaShop does : <id_order xlink:href=".../api/orders/3">3</id_order>,
+# read by prestapyt as {'attrs': {...}, 'value': '3'}
+XLINK_FIELDS = {
+    'current_state': 'order_states',
+    'id_address_delivery': 'addresses',
+    'id_address_invoice': 'addresses',
+    'id_carrier': 'carriers',
+    'id_cart': 'carts',
+    'id_category': 'categories',
+    'id_category_default': 'categories',
+    'id_country': 'countries',
+    'id_currency': 'currencies',
+    'id_customer': 'customers',
+    'id_default_group': 'groups',
+    'id_lang': 'languages',
+    'id_manufacturer': 'manufacturers',
+    'id_order': 'orders',
+    'id_parent': 'categories',
+    'id_product': 'products',
+    'id_shop': 'shops',
+    'id_shop_group': 'shop_groups',
+    'id_state': 'states',
+    'id_supplier': 'suppliers',
+    'id_tax_rules_group': 'tax_rule_groups',
+    'product_attribute_id': 'combinations',
+    'product_id': 'products',
+}
+
+FILTER_RE = re.compile(r'^filter\[(\w+)\]$')
+
+
+def singular(resource):
+    return SINGULAR_NAMES.get(resource, resource[:-1])
+
+
+def ps_date(timestamp):
+    return time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(timestamp))
+
+
+def generate_fixtures(nb_customers=100, nb_products=100, nb_orders=100, lines_per_order=3, seed=42):
+    """Return the resources served by the fake webservice, as a dict
+    {resource: {id: record}}. A record is a dict of strings, except the
+    fields with languages ({lang id: string}) and the associations
+    ({name: (node type, [dict of strings])})"""
+    rand = random.Random(seed)
+    now = time.time()
+    date_upd = ps_date(now - 3600)
+
+    def lang(text):
+        return {1: text, 2: '%s (fr)' % text}
+
+    fixtures = {
+        'languages': {
+            1: {'id': '1', 'name': 'English (English)', 'iso_code': 'en', 'language_code': 'en-us', 'active': '1'},
+            2: {'id': '2', 'name': u'Français (French)', 'iso_code': 'fr', 'language_code': 'fr', 'active': '1'},
+        },
+        'countries': {
+            8: {'id': '8', 'iso_code': 'FR', 'name': lang('France'), 'active': '1', 'contains_states': '0'},
+            21: {'id': '21', 'iso_code': 'US', 'name': lang('United States'), 'active': '1', 'contains_states': '1'},
+        },
+        'states': {
+            5: {'id': '5', 'id_country': '21', 'iso_code': 'CA', 'name': 'California', 'active': '1'},
+        },
+        'currencies': {
+            1: {'id': '1', 'iso_code': 'EUR', 'name': 'Euro', 'sign': 'EUR', 'conversion_rate': '1.000000'},
+            2: {'id': '2', 'iso_code': 'USD', 'name': 'Dollar', 'sign': '$', 'conversion_rate': '1.300000'},
+        },
+        'taxes': {
+            1: {'id': '1', 'rate': '20.000', 'active': '1', 'deleted': '0', 'name': lang('TVA FR 20%')},
+        },
+        'tax_rule_groups': {
+            1: {'id': '1', 'name': 'FR Taux standard (20%)', 'active': '1'},
+        },
+        'shop_groups': {
+            1: {'id': '1', 'name': 'Default', 'share_customer': '0', 'share_order': '0', 'share_stock': '0', 'active': '1'},
+        },
+        'shops': {
+            1: {'id': '1', 'id_shop_group': '1', 'id_category': '2', 'id_theme': '1', 'active': '1', 'name': 'Benchmark shop'},
+        },
+        'categories': {
+            1: {'id': '1', 'id_parent': '0', 'active': '1', 'is_root_category': '0', 'level_depth': '0',
+                'name': lang('Root'), 'link_rewrite': lang('root'), 'description': lang(''), 'date_upd': date_upd},
+            2: {'id': '2', 'id_parent': '1', 'active': '1', 'is_root_category': '1', 'level_depth': '1',
+                'name': lang('Home'), 'link_rewrite': lang('home'), 'description': lang(''), 'date_upd': date_upd},
+        },
+        'carriers': {
+            1: {'id': '1', 'name': 'Benchmark carrier', 'active': '1', 'deleted': '0', 'is_free': '0', 'delay': lang('2 days')},
+        },
+        'groups': {
+            1: {'id': '1', 'name': lang('Visitor'), 'reduction': '0.00', 'price_display_method': '0', 'date_upd': date_upd},
+            2: {'id': '2', 'name': lang('Guest'), 'reduction': '0.00', 'price_display_method': '0', 'date_upd': date_upd},
+            3: {'id': '3', 'name': lang('Customer'), 'reduction': '0.00', 'price_display_method': '0', 'date_upd': date_upd},
+        },
+        'customers': {},
+        'addresses': {},
+        'products': {},
+        'images': {},
+        'stock_availables': {},
+        'orders': {},
+        'order_details': {},
+        'order_histories': {},
+    }
+
+    address_id = 0
+    customer_addresses = {}
+    for customer_id in range(1, nb_customers + 1):
+        firstname = 'First%s' % customer_id
+        lastname = 'Last%s' % customer_id
+        fixtures['customers'][customer_id] = {
+            'id': str(customer_id), 'id_default_group': '3', 'firstname': firstname, 'lastname': lastname,
+            'email': 'customer%s@example.com' % customer_id, 'website': '', 'active': '1', 'deleted': '0',
+            'newsletter': str(rand.randint(0, 1)), 'date_add': date_upd, 'date_upd': date_upd,
+            'associations': {'groups': ('group', [{'id': '3'}])},
+        }
+        customer_addresses[customer_id] = []
+        for i in range(rand.randint(1, 2)):
+            address_id += 1
+            country_id = rand.choice(['8', '21'])
+            fixtures['addresses'][address_id] = {
+                'id': str(address_id), 'id_customer': str(customer_id), 'id_manufacturer': '0', 'id_supplier': '0',
+                'id_country': country_id, 'id_state': country_id == '21' and '5' or '0',
+                'alias': 'Address %s' % (i + 1), 'company': '', 'firstname': firstname, 'lastname': lastname,
+                'vat_number': '', 'address1': '%s Benchmark Street' % rand.randint(1, 200), 'address2': '',
+                'postcode': '%05d' % rand.randint(1000, 99999), 'city': 'City%s' % rand.randint(1, 50),
+                'phone': '0102030405', 'phone_mobile': '0607080910', 'deleted': '0',
+                'date_add': date_upd, 'date_upd': date_upd,
+            }
+            customer_addresses[customer_id].append(address_id)
+
+    image_id = 0
+    for product_id in range(1, nb_products + 1):
+        image_id += 1
+        fixtures['images'][image_id] = {'id': str(image_id), 'id_product': str(product_id)}
+        fixtures['stock_availables'][product_id] = {
+            'id': str(product_id), 'id_product': str(product_id), 'id_product_attribute': '0', 'id_shop': '1',
+            'id_shop_group': '0', 'quantity': str(rand.randint(0, 100)), 'depends_on_stock': '0', 'out_of_stock': '2',
+        }
+        fixtures['products'][product_id] = {
+            'id': str(product_id), 'id_category_default': '2', 'id_tax_rules_group': '1', 'type': 'simple',
+            'reference': 'BENCH-%05d' % product_id, 'ean13': '0', 'active': '1', 'available_for_sale': '1',
+            'price': '%.6f' % rand.uniform(1, 500), 'wholesale_price': '%.6f' % rand.uniform(1, 200),
+            'weight': '%.6f' % rand.uniform(0, 10), 'date_add': date_upd, 'date_upd': date_upd,
+            'name': lang('Product %s' % product_id), 'link_rewrite': lang('product-%s' % product_id),
+            'description': lang('<p>Description of the product %s</p>' % product_id),
+            'description_short': lang('Product %s' % product_id),
+            'associations': {
+                'categories': ('category', [{'id': '2'}]),
+                'images': ('image', [{'id': str(image_id)}]),
+                'stock_availables': ('stock_available', [{'id': str(product_id), 'id_product_attribute': '0'}]),
+            },
+        }
+
+    detail_id = 0
+    for order_id in range(1, nb_orders + 1):
+        customer_id = rand.randint(1, max(nb_customers, 1))
+        address_id = rand.choice(customer_addresses.get(customer_id) or [0])
+        rows = []
+        total = 0.0
+        for i in range(lines_per_order):
+            detail_id += 1
+            product_id = rand.randint(1, max(nb_products, 1))
+            quantity = rand.randint(1, 5)
+            price = float(fixtures['products'].get(product_id, {}).get('price') or 10.0)
+            total += quantity * price * 1.2
+            fixtures['order_details'][detail_id] = {
+                'id': str(detail_id), 'id_order': str(order_id), 'product_id': str(product_id),
+                'product_attribute_id': '0', 'product_name': 'Product %s' % product_id,
+                'product_quantity': str(quantity), 'product_price': '%.6f' % price,
+                'original_product_price': '%.6f' % price, 'reduction_percent': '0.00',
+                'unit_price_tax_incl': '%.6f' % (price * 1.2), 'unit_price_tax_excl': '%.6f' % price,
+                'associations': {'taxes': ('tax', [{'id': '1'}])},
+            }
+            rows.append({'id': str(detail_id), 'product_id': str(product_id), 'product_attribute_id': '0',
+                         'product_quantity': str(quantity), 'product_name': 'Product %s' % product_id,
+                         'product_price': '%.6f' % price, 'unit_price_tax_incl': '%.6f' % (price * 1.2),
+                         'unit_price_tax_excl': '%.6f' % price})
+        fixtures['orders'][order_id] = {
+            'id': str(order_id), 'id_address_delivery': str(address_id), 'id_address_invoice': str(address_id),
+            'id_cart': str(order_id), 'id_currency': '1', 'id_lang': '1', 'id_customer': str(customer_id),
+            'id_carrier': '1', 'id_shop_group': '1', 'id_shop': '1', 'current_state': '2', 'module': 'bankwire',
+            'payment': 'Bank wire', 'valid': '1', 'reference': 'BENCH%05d' % order_id,
+            'total_paid': '%.6f' % (total + 8.4), 'total_paid_tax_incl': '%.6f' % (total + 8.4),
+            'total_paid_real': '%.6f' % (total + 8.4), 'total_products': '%.6f' % (total / 1.2),
+            'total_products_wt': '%.6f' % total, 'total_shipping': '8.400000',
+            'total_shipping_tax_incl': '8.400000', 'total_shipping_tax_excl': '7.000000',
+            'conversion_rate': '1.000000', 'date_add': date_upd, 'date_upd': date_upd,
+            'associations': {'order_rows': ('order_row', rows)},
+        }
+    return fixtures
+
+
+class RequestStats(object):
+    """Count the requests and the bytes sent by the fake webservice"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = {}
+        self.bytes_sent = 0
+
+    def add(self, method, resource, nr_bytes):
+        with self._lock:
+            key = (method, resource)
+            self.requests[key] = self.requests.get(key, 0) + 1
+            self.bytes_sent += nr_bytes
+
+    def snapshot(self):
+        with self._lock:
+            return {'requests': dict(self.requests), 'bytes_sent': self.bytes_sent}
+
+
+class FakePrestaShop(object):
+    """Answer the webservice requests from the fixtures"""
+
+    def __init__(self, fixtures, api_key='BENCHMARK', latency=0.0):
+        self.fixtures = fixtures
+        self.api_key = api_key
+        self.latency = latency
+        self.stats = RequestStats()
+        self._lock = threading.Lock()
+        self._next_ids = dict((resource, max(records.keys() or [0]) + 1)
+                              for resource, records in fixtures.items())
+
+    # Filters
+
+    def _match(self, value, condition):
+        if condition.startswith('>[') or condition.startswith('<['):
+            limit = condition[2:-1]
+            try:
+                value, limit = float(value), float(limit)
+            except ValueError:
+                pass
+            return condition[0] == '>' and value > limit or condition[0] == '<' and value < limit
+        if condition.startswith('[') and condition.endswith(']'):
+            condition = condition[1:-1]
+            if ',' in condition:
+                low, high = condition.split(',', 1)
+                try:
+                    return float(low) <= float(value) <= float(high)
+                except ValueError:
+                    return low <= value <= high
+            return value in condition.split('|')
+        return value == condition
+
+    def _select(self, records, params):
+        selected = records.values()
+        for key, condition in params.items():
+            match = FILTER_RE.match(key)
+            if match:
+                field = match.group(1)
+                selected = [record for record in selected
+                            if not isinstance(record.get(field), dict)
+                            and self._match(record.get(field, ''), condition)]
+        reverse = False
+        sort = params.get('sort', '')
+        sort_field = 'id'
+        if sort:
+            sort_field, direction = sort.strip('[]').rsplit('_', 1)
+            reverse = direction.upper() == 'DESC'
+        if sort_field == 'id':
+            selected.sort(key=lambda record: int(record['id']), reverse=reverse)
+        else:
+            selected.sort(key=lambda record: record.get(sort_field), reverse=reverse)
+        limit = params.get('limit')
+        if limit:
+            if ',' in limit:
+                offset, limit = limit.split(',')
+                selected = selected[int(offset):int(offset) + int(limit)]
+            else:
+                selected = selected[:int(limit)]
+        return selected
+
+    # Rendering
+
+    def _record_xml(self, tag, record, xlink=True):
+        parts = ['<%s>' % tag]
+        for key in sorted(record.keys(), key=lambda key: (key != 'id', key)):
+            value = record[key]
+            if key == 'associations':
+                parts.append('<associations>')
+                for name, (node_type, rows) in sorted(value.items()):
+                    parts.append('<%s nodeType="%s" api="%s">' % (name, node_type, name))
+                    for row in rows:
+                        parts.append(self._record_xml(node_type, row, xlink=False))
+                    parts.append('</%s>' % name)
+                parts.append('</associations>')
+            elif isinstance(value, dict):
+                parts.append('<%s>' % key)
+                for lang_id, text in sorted(value.items()):
+                    parts.append('<language id="%s"><![CDATA[%s]]></language>' % (lang_id, text))
+                parts.append('</%s>' % key)
+            elif xlink and key in XLINK_FIELDS and value not in ('', None):
+                parts.append('<%s xlink:href="%s"><![CDATA[%s]]></%s>' % (
+                    key, escape('/api/%s/%s' % (XLINK_FIELDS[key], value)), value, key))
+            else:
+                parts.append('<%s><![CDATA[%s]]></%s>' % (key, value, key))
+        parts.append('</%s>' % tag)
+        return ''.join(parts)
+
+    def _record_json(self, record):
+        res = {}
+        for key, value in record.items():
+            if key == 'associations':
+                res[key] = dict((name, rows) for name, (node_type, rows) in value.items())
+            elif isinstance(value, dict):
+                res[key] = [{'id': str(lang_id), 'value': text} for lang_id, text in sorted(value.items())]
+            elif key == 'id':
+                res[key] = int(value)
+            else:
+                res[key] = value
+        return res
+
+    def _render(self, resource, records, params, single=False):
+        tag = singular(resource.split('/')[0])
+        display = params.get('display', '')
+        full = single or display == 'full'
+        if display.startswith('[') and not single:
+            # display=[id,date_upd] : only the given fields
+            display_fields = display.strip('[]').split(',')
+            records = [dict((key, value) for key, value in record.items() if key in display_fields)
+                       for record in records]
+            full = True
+        if params.get('output_format') == 'JSON':
+            if single:
+                return json.dumps({tag: self._record_json(records[0])}), 'application/json'
+            if not records:
+                return '[]', 'application/json'
+            if full:
+                return json.dumps({resource: [self._record_json(record) for record in records]}), 'application/json'
+            return json.dumps({resource: [{'id': int(record['id'])} for record in records]}), 'application/json'
+        if single:
+            body = self._record_xml(tag, records[0])
+        elif full:
+            body = '<%s>%s</%s>' % (resource, ''.join(self._record_xml(tag, record) for record in records), resource)
+        else:
+            body = '<%s>%s</%s>' % (resource, ''.join(
+                '<%s id="%s" xlink:href="%s"/>' % (tag, record['id'], escape('/api/%s/%s' % (resource, record['id'])))
+                for record in records), resource)
+        xml = ('<?xml version="1.0" encoding="UTF-8"?>\n'
+               '<prestashop xmlns:xlink="http://www.w3.org/1999/xlink">%s</prestashop>' % body)
+        if isinstance(xml, unicode):
+            xml = xml.encode('utf-8')
+        return xml, 'text/xml;charset=utf-8'
+
+    # Requests
+
+    def handle(self, method, path, params, body):
+        """Return (status, content, content type) for a request"""
+        if self.latency:
+            time.sleep(self.latency)
+        parts = [urllib.unquote(part) for part in path.strip('/').split('/')[1:] if part]
+        if not parts:
+            return 200, self._render('api', [], params)[0], 'text/xml;charset=utf-8'
+        if parts[0] == 'images':
+            return self._handle_images(method, parts, params, body)
+        resource = parts[0]
+        records = self.fixtures.get(resource)
+        if records is None:
+            return 404, '', 'text/xml'
+        resource_id = len(parts) > 1 and int(parts[1]) or None
+        if method in ('GET', 'HEAD'):
+            if resource_id is not None:
+                if resource_id not in records:
+                    return 404, '', 'text/xml'
+                content, content_type = self._render(resource, [records[resource_id]], params, single=True)
+            else:
+                content, content_type = self._render(resource, self._select(records, params), params)
+            return 200, content, content_type
+        if method == 'DELETE':
+            ids = resource_id is not None and [resource_id] or \
+                [int(id) for id in params.get('id', '').strip('[]').split(',') if id]
+            with self._lock:
+                for id in ids:
+                    records.pop(id, None)
+            return 200, '', 'text/xml'
+        if method in ('PUT', 'POST'):
+            return self._save(resource, records, resource_id, method, body)
+        return 405, '', 'text/xml'
+
+    def _save(self, resource, records, resource_id, method, body):
+        tag = singular(resource)
+        try:
+            element = ElementTree.fromstring(body).find(tag)
+        except SyntaxError:
+            return 400, '', 'text/xml'
+        values = dict((child.tag, child.text or '') for child in element if not len(child))
+        with self._lock:
+            if method == 'POST':
+                resource_id = self._next_ids.get(resource, 1)
+                self._next_ids[resource] = resource_id + 1
+            elif resource_id is None:
+                resource_id = values.get('id', '').isdigit() and int(values['id']) or None
+            record = records.get(resource_id)
+            if record is None:
+                if method == 'PUT' and resource != 'stock_availables':
+                    return 404, '', 'text/xml'
+                record = records.setdefault(resource_id or self._next_ids.get(resource, 1), {})
+            record.update(values)
+            record['id'] = str(resource_id)
+        content, content_type = self._render(resource, [record], {}, single=True)
+        return method == 'POST' and 201 or 200, content, content_type
+
+    def _handle_images(self, method, parts, params, body):
+        images = self.fixtures['images']
+        if len(parts) < 2 or parts[1] != 'products':
+            return 404, '', 'text/xml'
+        if len(parts) == 2:
+            product_ids = sorted(set(int(image['id_product']) for image in images.values()))
+            content, content_type = self._render('images', [{'id': str(id)} for id in product_ids], {})
+            return 200, content, content_type
+        product_id = int(parts[2])
+        if method == 'POST':
+            with self._lock:
+                image_id = self._next_ids.get('images', 1)
+                self._next_ids['images'] = image_id + 1
+                images[image_id] = {'id': str(image_id), 'id_product': str(product_id)}
+            return 200, self._render('images', [{'id': str(image_id)}], {}, single=True)[0], 'text/xml;charset=utf-8'
+        if method == 'DELETE':
+            with self._lock:
+                images.pop(len(parts) > 3 and int(parts[3]) or None, None)
+            return 200, '', 'text/xml'
+        image_ids = [image['id'] for image in images.values() if int(image['id_product']) == product_id]
+        if not image_ids:
+            return 500, '', 'text/xml'
+        content = ('<?xml version="1.0" encoding="UTF-8"?>\n'
+                   '<prestashop xmlns:xlink="http://www.w3.org/1999/xlink"><image id="%s">%s</image></prestashop>'
+                   % (product_id, ''.join('<declination id="%s"/>' % id for id in image_ids)))
+        return 200, content, 'text/xml;charset=utf-8'
+
+
+class FakePrestaShopHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def _authenticated(self):
+        auth = self.headers.get('Authorization', '')
+        if auth.startswith('Basic '):
+            login = base64.b64decode(auth[6:]).split(':')[0]
+            if login == self.server.prestashop.api_key:
+                return True
+        self._send(401, '', 'text/html', extra_headers={
+            'WWW-Authenticate': 'Basic realm="Welcome to PrestaShop Webservice, please enter the authentication key as the login. No password required."'})
+        return False
+
+    def _send(self, status, content, content_type, extra_headers=None):
+        if content and 'gzip' in self.headers.get('Accept-Encoding', ''):
+            buf = StringIO()
+            zfile = gzip.GzipFile(fileobj=buf, mode='wb')
+            zfile.write(content)
+            zfile.close()
+            content = buf.getvalue()
+            extra_headers = dict(extra_headers or {}, **{'Content-Encoding': 'gzip'})
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(content)))
+        self.send_header('PSWS-Version', PSWS_VERSION)
+        for key, value in (extra_headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(content)
+        return len(content)
+
+    def _dispatch(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = length and self.rfile.read(length) or ''
+        url = urlparse.urlparse(self.path)
+        resource = (url.path.strip('/').split('/') + [''])[1]
+        if not self._authenticated():
+            self.server.prestashop.stats.add(self.command, resource, 0)
+            return
+        params = dict(urlparse.parse_qsl(url.query, keep_blank_values=True))
+        status, content, content_type = self.server.prestashop.handle(self.command, url.path, params, body)
+        nr_bytes = self._send(status, content, content_type)
+        self.server.prestashop.stats.add(self.command, resource, nr_bytes)
+
+    do_GET = do_HEAD = do_PUT = do_POST = do_DELETE = _dispatch
+
+
+class FakePrestaShopServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, prestashop, host='127.0.0.1', port=0):
+        BaseHTTPServer.HTTPServer.__init__(self, (host, port), FakePrestaShopHandler)
+        self.prestashop = prestashop
+
+    @property
+    def location(self):
+        return 'http://%s:%s' % self.server_address
+
+
+def start_fake_webservice(prestashop, host='127.0.0.1', port=0):
+    """Start the fake webservice in a thread and return the server, stop it
+    with server.shutdown()"""
+    server = FakePrestaShopServer(prestashop, host=host, port=port)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+if __name__ == '__main__':
+    import optparse
+    parser = optparse.OptionParser()
+    parser.add_option('--host', default='127.0.0.1')
+    parser.add_option('--port', type='int', default=8069)
+    parser.add_option('--key', default='BENCHMARK', help="webservice key")
+    parser.add_option('--customers', type='int', default=100)
+    parser.add_option('--products', type='int', default=100)
+    parser.add_option('--orders', type='int', default=100)
+    parser.add_option('--lines', type='int', default=3, help="lines per order")
+    parser.add_option('--latency', type='float', default=0.0, help="seconds added to each request")
+    options, args = parser.parse_args()
+    fixtures = generate_fixtures(options.customers, options.products, options.orders, options.lines)
+    server = FakePrestaShopServer(FakePrestaShop(fixtures, options.key, options.latency),
+                                  host=options.host, port=options.port)
+    print "Fake PrestaShop webservice on %s/api (key %s)" % (server.location, options.key)
+    server.serve_forever()
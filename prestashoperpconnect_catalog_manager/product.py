@@ -25,6 +25,8 @@
 from osv import osv, fields
 from base_external_referentials.decorator import only_for_referential, catch_error_in_report, open_report
 from prestapyt import PrestaShopWebServiceError
+from openerp.addons.prestashoperpconnect.export_digest import compute_digest
+from openerp.addons.prestashoperpconnect.product_images import get_image_inventory
 from tools.translate import _
 import logging
 
@@ -50,15 +52,24 @@ class product_category(osv.osv):
         _logger.info('Product category: sync regular data first')
         res = super(product_category, self).call_prestashop_method(cr, uid, external_session, resource_id, resource, method, mapping=mapping, mapping_id=mapping_id, context=context)
         # take care of IMAGE now
-        # If the method is edit, I always delete and re-create the image
+        # If the method is edit, I delete and re-create the image when it
+        # changed since its last export
+        digest_obj = self.pool.get('prestashop.export.digest')
+        referential_id = external_session.referential_id.id
+        image_digest = compute_digest(image_filename, image_binary)
+        if method == 'edit' and image_digest == digest_obj.get_digest(cr, uid, self._name, resource_id,
+                                                                      referential_id, 'image', context=context):
+            _logger.info("Product category: image of PS product category ID %d didn't change, skipped" % resource['category'].get('id'))
+            return res
+        image_inventory = get_image_inventory(external_session, 'images/' + mapping[mapping_id]['external_resource_name'])
         if method == 'edit':
-            ps_categ_ids_with_images = external_session.connection.search('images/' + mapping[mapping_id]['external_resource_name'])
             # Check that you have the fix for this PS bug :
             # http://forge.prestashop.com/browse/PSCFV-6559
-            if ps_categ_ids_with_images and resource['category'].get('id') in ps_categ_ids_with_images:
+            if image_inventory.has_image(resource['category'].get('id')):
                 # Delete the image
                 _logger.info('Deleting image of product category PS ID %d' % resource['category'].get('id'))
                 external_session.connection.delete('images/' + mapping[mapping_id]['external_resource_name'], resource['category'].get('id'))
+                image_inventory.remove(resource['category'].get('id'))
         if image_binary:
             if method == 'add':
                 ps_categ_id = int(res)
@@ -71,9 +82,11 @@ class product_category(osv.osv):
 #                POST //api/images/categories/None
 # -> PS WS answers 400
                 getattr(external_session.connection, mapping[mapping_id]['external_create_method'] or 'add')('images/' + mapping[mapping_id]['external_resource_name'] + '/' + str(ps_categ_id), image_binary, img_filename=image_filename)
+                image_inventory.add(ps_categ_id)
             except PrestaShopWebServiceError, e:
                 _logger.warning("PrestaShop webservice answered an error on upload of image category. HTTP error code: %s, PrestaShop error code: %s, PrestaShop error message: %s" % (e.error_code, e.ps_error_code, e.ps_error_msg))
                 raise osv.except_osv(_('PrestaShop Webservice Error:'), e.ps_error_msg)
+        digest_obj.set_digest(cr, uid, self._name, resource_id, referential_id, 'image', image_digest, context=context)
         return res
 
 
@@ -103,21 +116,80 @@ class product_product(osv.osv):
                         vals[attribute.external_name] = resource[attribute.name]
         return vals
     
-    def _get_product_feature(self, cr, uid, external_session, product_lang, langs, langs_to_ext_id, context=None):
+    def _prepare_feature_maps(self, cr, uid, external_session, products, context=None):
+        """Map the attributes and the options used by the products with the
+        PrestaShop features and feature values. The missing ones are created
+        in PrestaShop before the products are exported, then the features of
+        the products are built from the maps
+        :return: tuple (ExternalIdMap of the attributes, ExternalIdMap of the options)
+        """
+        attribute_obj = self.pool.get('product.attribute')
+        option_obj = self.pool.get('attribute.option')
+        attribute_map = attribute_obj.get_external_id_map(cr, uid, external_session, context=context)
+        option_map = option_obj.get_external_id_map(cr, uid, external_session, context=context)
+        attribute_ids = set()
+        option_ids = set()
+        for product in products:
+            if not product.attribute_set_id:
+                continue
+            for group in product.attribute_set_id.attribute_group_ids:
+                for attribute in group.attribute_ids:
+                    attribute_ids.add(attribute.attribute_id.id)
+                    if attribute.ttype == 'many2one':
+                        feature_value = getattr(product, attribute.name)
+                        if feature_value:
+                            option_ids.add(feature_value.id)
+        # The features must exist before their values
+        for attribute_id in attribute_ids:
+            if not attribute_map.get_extid(attribute_id):
+                attribute_map.add(attribute_id, attribute_obj.get_or_create_extid(cr, uid, external_session, attribute_id, context=context))
+        for option_id in option_ids:
+            if not option_map.get_extid(option_id):
+                option_map.add(option_id, option_obj.get_or_create_extid(cr, uid, external_session, option_id, context=context))
+        return attribute_map, option_map
+
+    def _read_translations(self, cr, uid, ids, field_names, langs, context=None):
+        """Read the fields of all the products in each language, with one
+        read by language instead of one browse by product and language
+        :return: dictionary {lang: {product id: {field: value}}}
+        :rtype: dict
+        """
+        res = {}
+        for lang in langs:
+            res[lang] = {}
+            if not field_names:
+                continue
+            ctx = dict(context or {}, lang=lang)
+            for values in self.read(cr, uid, ids, field_names, context=ctx):
+                res[lang][values['id']] = values
+        return res
+
+    def _get_translatable_feature_fields(self, cr, uid, products, context=None):
+        """Return the fields of the features sent with a value by language"""
+        field_names = set()
+        for product in products:
+            for group in product.attribute_set_id and product.attribute_set_id.attribute_group_ids or []:
+                for attribute in group.attribute_ids:
+                    if attribute.ttype != 'many2one':
+                        field_names.add(attribute.name)
+        return list(field_names)
+
+    def _get_product_feature(self, cr, uid, external_session, product, lang_values, langs, langs_to_ext_id, context=None):
+        attribute_map, option_map = self._prepare_feature_maps(cr, uid, external_session, [product], context=context)
         product_feature = []
-        for group in product_lang[langs[0]].attribute_set_id.attribute_group_ids:
+        for group in product.attribute_set_id.attribute_group_ids:
                     for attribute in group.attribute_ids:
-                        feature_dict = {'id': self.pool.get('product.attribute').get_or_create_extid(cr, uid, external_session, attribute.attribute_id.id, context=context)}
+                        feature_dict = {'id': attribute_map.get_extid(attribute.attribute_id.id)}
                         if attribute.ttype == 'many2one':
-                            feature_value = getattr(product_lang[langs[0]], attribute.name)
+                            feature_value = getattr(product, attribute.name)
                             if feature_value:
-                                feature_dict['id_feature_value'] = self.pool.get('attribute.option').get_or_create_extid(cr, uid, external_session, feature_value.id, context=context)
+                                feature_dict['id_feature_value'] = option_map.get_extid(feature_value.id)
                             else:
                                 continue
                         else:
                             feature_langs = []
                             for lang in langs:
-                                feature_langs.append({'attrs': {'id': '%s'%langs_to_ext_id[lang]}, 'value': getattr(product_lang[lang], attribute.name)})
+                                feature_langs.append({'attrs': {'id': '%s'%langs_to_ext_id[lang]}, 'value': lang_values[lang][product.id][attribute.name]})
                             feature_dict.update({
                                 'id_feature_value': 0,
                                 'custom_feature_value': {'language': feature_langs},
@@ -127,19 +199,20 @@ class product_product(osv.osv):
 
     def send_to_external(self, cr, uid, external_session, resources, mapping, mapping_id, update_date=None, context=None):
         langs = self.get_lang_to_export(cr, uid, external_session, context=context)
-        langs_to_ext_id = {}
-        for lang in langs:
-            lang_id = self.pool.get('res.lang').search(cr, uid, [('code', '=', lang)], context=context)[0]
-            langs_to_ext_id[lang] = self.pool.get('res.lang').get_extid(cr, uid, lang_id, external_session.referential_id.id, context=context)
+        langs_to_ext_id = self.get_prestashop_lang_map(cr, uid, external_session, lang_codes=langs, context=context)
+        ctx = context.copy()
+        ctx['lang'] = langs[0]
+        products = self.browse(cr, uid, resources.keys(), context=ctx)
+        # Map (and create) the features of all the products at once
+        self._prepare_feature_maps(cr, uid, external_session, products, context=context)
+        feature_fields = self._get_translatable_feature_fields(cr, uid, products, context=context)
+        lang_values = self._read_translations(cr, uid, resources.keys(), feature_fields, langs, context=context)
+        products = dict([(product.id, product) for product in products])
         for resource_id, resource in resources.items():
-            product_lang = {}
-            for lang in langs:
-                ctx = context.copy()
-                ctx['lang'] = lang
-                product_lang[lang] = self.browse(cr, uid, resource_id, context=ctx)
+            product = products[resource_id]
             product_feature = []
-            if product_lang[langs[0]].attribute_set_id:
-                product_feature = self._get_product_feature(cr, uid, external_session, product_lang, langs,langs_to_ext_id, context=context)
+            if product.attribute_set_id:
+                product_feature = self._get_product_feature(cr, uid, external_session, product, lang_values, langs, langs_to_ext_id, context=context)
             if not resource['no_lang'].get('associations'):
                 resource['no_lang']['associations'] = {}
             resource['no_lang']['associations']['product_features'] = {'product_feature': product_feature}
@@ -22,20 +22,66 @@
 from osv import osv, fields
 import netsvc
 from base_external_referentials.external_osv import ExternalSession
+from openerp.addons.prestashoperpconnect.prestashop_osv import get_list_elements, get_field_value, get_fetcher, BATCH_READ_SIZE
+
+# Maximum number of order rows deleted by one request
+DELETE_BATCH_SIZE = 50
 
 class sale_order(osv.osv):
 
     _inherit = "sale.order"
 
+    def _get_prestashop_order_rows(self, cr, uid, external_session, ps_order_ids, context=None):
+        """Read the ids of the rows of all the given orders with one request
+        per BATCH_READ_SIZE orders
+        :return: dictionary {ps order id: set of the ps order row ids}
+        :rtype: dict
+        """
+        order_rows = dict([(int(ps_order_id), set()) for ps_order_id in ps_order_ids])
+        ps_order_ids = order_rows.keys()
+        for i in range(0, len(ps_order_ids), BATCH_READ_SIZE):
+            response = external_session.connection.get('order_details', options={
+                'filter[id_order]': '[%s]' % '|'.join([str(x) for x in ps_order_ids[i:i + BATCH_READ_SIZE]]),
+                'display': '[id,id_order]',
+            })
+            for order_row in get_list_elements(response):
+                order_rows[int(get_field_value(order_row['id_order']))].add(str(get_field_value(order_row['id'])))
+        return order_rows
+
+    def _delete_prestashop_order_rows(self, cr, uid, external_session, ps_order_row_ids, context=None):
+        """Delete the order rows by batches, the batches are deleted
+        concurrently when the referential allows it"""
+        ps_order_row_ids = sorted(ps_order_row_ids)
+        batches = [ps_order_row_ids[i:i + DELETE_BATCH_SIZE] for i in range(0, len(ps_order_row_ids), DELETE_BATCH_SIZE)]
+        fetcher = len(batches) > 1 and get_fetcher(external_session)
+        if fetcher:
+            for delete in [fetcher.submit(external_session.connection.delete, 'order_details', batch) for batch in batches]:
+                delete.get()
+        else:
+            for batch in batches:
+                external_session.connection.delete('order_details', batch)
+        return True
+
     def edit_prestashop_order(self, cr, uid, ids, context=None):
+        """Delete in PrestaShop the rows of the orders which were removed
+        from the sale orders. The rows of all the orders are read at once
+        and the stale rows are deleted with batched requests"""
+        orders_by_referential = {}
         for sale_order in self.browse(cr, uid, ids, context=context):
-            external_session = ExternalSession(sale_order.referential_id, sale_order)
-            ext_id = sale_order.get_extid(external_session.referential_id.id, context=context)
-            prestashop_order = external_session.connection.get('orders', ext_id)
-            oe_line_ids = [l.ext_ref_line for l in sale_order.order_line if l.ext_ref_line]
-            presta_lines = prestashop_order['order']['associations']['order_rows']['order_row']
-            if isinstance(presta_lines, dict): presta_lines = [presta_lines]
-            for presta_line in presta_lines:
-                if not presta_line['id'] in oe_line_ids:
-                    del_line = external_session.connection.delete('order_details', presta_line['id'])
+            orders_by_referential.setdefault(sale_order.referential_id.id, []).append(sale_order)
+        for sale_orders in orders_by_referential.values():
+            external_session = ExternalSession(sale_orders[0].referential_id, sale_orders[0])
+            order_ext_ids = self.get_external_ids(cr, uid, external_session,
+                                    [sale_order.id for sale_order in sale_orders], context=context)
+            oe_line_ids = {}
+            for sale_order in sale_orders:
+                ext_id = order_ext_ids.get(sale_order.id)
+                if ext_id:
+                    oe_line_ids[int(ext_id)] = set([str(l.ext_ref_line) for l in sale_order.order_line if l.ext_ref_line])
+            presta_lines = self._get_prestashop_order_rows(cr, uid, external_session, oe_line_ids.keys(), context=context)
+            stale_line_ids = set()
+            for ps_order_id, ps_line_ids in presta_lines.items():
+                stale_line_ids |= ps_line_ids - oe_line_ids[ps_order_id]
+            if stale_line_ids:
+                self._delete_prestashop_order_rows(cr, uid, external_session, stale_line_ids, context=context)
         return True
@@ -21,40 +21,134 @@
 ##############################################################################
 
 from openerp.osv.orm import Model
+from osv import osv
 from tools.translate import _
-from prestapyt import PrestaShopWebServiceError
+from openerp.addons.prestashoperpconnect.prestashop_osv import session_cache, get_list_elements, get_field_value, get_fetcher, BATCH_READ_SIZE
 import logging
+import threading
 
 _logger = logging.getLogger(__name__)
 
+# Composition of the PrestaShop products which are not mapped, kept between
+# the imports : {(dbname, referential_id): {ps product id: (date_upd, pack lines)}}
+# The pack lines are a list of (ps product id, quantity), None if the
+# product is not a pack
+_pack_cache = {}
+_pack_cache_lock = threading.Lock()
+
+
+def _get_pack_lines(product):
+    """Return the composition of a product read in XML, None if it is not a pack"""
+    if get_field_value(product['type']) != 'pack':
+        return None
+    bundle = product.get('associations', {}).get('product_bundle') or {}
+    pack_lines = bundle.get('product') or []
+    if isinstance(pack_lines, dict):
+        pack_lines = [pack_lines]
+    return [(int(line['id']), int(line['quantity'])) for line in pack_lines]
+
 
 class sale_order_line(Model):
     _inherit = 'sale.order.line'
 
+    def _read_ps_products(self, cr, uid, external_session, ps_product_ids, display, context=None):
+        """Read the given products with batched requests, in XML
+        :return: list of the products
+        """
+        ps_product_ids = list(ps_product_ids)
+        options_list = [{'filter[id]': '[%s]' % '|'.join([str(x) for x in ps_product_ids[i:i + BATCH_READ_SIZE]]),
+                         'display': display}
+                        for i in range(0, len(ps_product_ids), BATCH_READ_SIZE)]
+        fetcher = len(options_list) > 1 and get_fetcher(external_session)
+        if fetcher:
+            responses = [fetch.get() for fetch in
+                            [fetcher.submit(external_session.connection.get, 'products', options=options)
+                                for options in options_list]]
+        else:
+            responses = [external_session.connection.get('products', options=options) for options in options_list]
+        products = []
+        for response in responses:
+            products += get_list_elements(response)
+        return products
+
+    def _prefetch_pack_compositions(self, cr, uid, external_session, ps_product_ids, context=None):
+        """Get the composition of the given products. The compositions are
+        cached between the imports : the products which are not cached are
+        read with all their fields, the cached ones only when their date_upd
+        changed since they were cached"""
+        checked = session_cache(external_session, 'pack_checked')
+        ps_product_ids = set([int(x) for x in ps_product_ids]) - checked
+        if not ps_product_ids:
+            return True
+        with _pack_cache_lock:
+            cache = _pack_cache.setdefault((cr.dbname, external_session.referential_id.id), {})
+            cached_ids = [ps_product_id for ps_product_id in ps_product_ids if ps_product_id in cache]
+        # The products which are not cached are read at once with all their fields
+        to_read = list(ps_product_ids - set(cached_ids))
+        if cached_ids:
+            dates = dict([(int(product['id']), product.get('date_upd'))
+                            for product in self._read_ps_products(cr, uid, external_session, cached_ids, '[id,date_upd]', context=context)])
+            with _pack_cache_lock:
+                to_read += [ps_product_id for ps_product_id, date_upd in dates.items()
+                            if ps_product_id not in cache or cache[ps_product_id][0] != date_upd]
+        if to_read:
+            compositions = {}
+            for product in self._read_ps_products(cr, uid, external_session, to_read, 'full', context=context):
+                if not product.get('type'):
+                    raise osv.except_osv(_('Error :'), _("Your PrestaShop instance doesn't have support for products packs via the webservices."))
+                compositions[int(product['id'])] = (product.get('date_upd'), _get_pack_lines(product))
+            with _pack_cache_lock:
+                cache.update(compositions)
+        _logger.debug("Pack compositions: %s cached products checked, %s read" % (len(cached_ids), len(to_read)))
+        checked.update(ps_product_ids)
+        return True
+
+    def _get_pack_composition(self, cr, uid, external_session, ps_product_id, context=None):
+        """Return the composition of the product as a list of
+        (ps product id, quantity), None if it is not a pack"""
+        ps_product_id = int(ps_product_id)
+        self._prefetch_pack_compositions(cr, uid, external_session, [ps_product_id], context=context)
+        with _pack_cache_lock:
+            composition = _pack_cache.get((cr.dbname, external_session.referential_id.id), {}).get(ps_product_id)
+        if composition is None:
+            raise osv.except_osv(_('Error :'), _("The product ID %s doesn't exist in PrestaShop") % ps_product_id)
+        return composition[1]
+
+    def _prefetch_so_lines_details(self, cr, uid, external_session, ps_order_row_ids, context=None):
+        res = super(sale_order_line, self)._prefetch_so_lines_details(cr, uid, external_session, ps_order_row_ids, context=context)
+        # Get the composition of the products which are not mapped, they may be packs
+        prefetched = session_cache(external_session, 'order_details')
+        product_map = self.pool.get('product.product').get_external_id_map(cr, uid, external_session, context=context)
+        ps_product_ids = set()
+        for ps_order_row_id in ps_order_row_ids:
+            resource = prefetched.get(int(ps_order_row_id))
+            if resource and not product_map.get_oeid(resource[0]['product_id']):
+                ps_product_ids.add(resource[0]['product_id'])
+        self._prefetch_pack_compositions(cr, uid, external_session, ps_product_ids, context=context)
+        return res
+
     def _get_so_line_details(self, cr, uid, external_session, ps_order_row_id, context=None):
         resource = super(sale_order_line, self)._get_so_line_details(cr, uid, external_session, ps_order_row_id, context=context)
         # Check that this product is mapped
         ps_product_id = resource[0]['product_id']
-        if self.pool.get('product.product').get_oeid(cr, uid, ps_product_id, external_session.referential_id.id, context=context):
+        product_map = self.pool.get('product.product').get_external_id_map(cr, uid, external_session, context=context)
+        if product_map.get_oeid(ps_product_id):
             return resource
         else:
-            product_pack_res = external_session.connection.get('products', ps_product_id)
-            if not product_pack_res['product'].get('type'):
-                raise osv.except_osv(_('Error :'), _("Your PrestaShop instance doesn't have support for products packs via the webservices."))
-
+            pack_lines = self._get_pack_composition(cr, uid, external_session, ps_product_id, context=context)
             resource_pack = []
-            if product_pack_res['product']['type'].get('value') != 'pack':
+            if pack_lines is None:
                 return resource
             else:
                 _logger.info('Product of type pack detected in PrestaShop order line ID %d' %ps_order_row_id)
                 # Here, we generate our own "resource" based on the composition
                 # of the pack
-                for pack_bom_line in product_pack_res['product']['associations']['product_bundle']['product']:
+                for pack_product_id, pack_quantity in pack_lines:
                     resource_pack.append({
                         'id_order': resource[0]['id_order'],
-                        'product_id': pack_bom_line['id'],
+                        'product_id': pack_product_id,
                         'reduction_percent': resource[0]['reduction_percent'],
-                        'product_quantity': str(int(pack_bom_line['quantity']) * int(resource[0]['product_quantity'])),
+                        'product_quantity': str(pack_quantity * int(resource[0]['product_quantity'])),
                         'taxes': resource[0]['taxes'],
                     })
                 return resource_pack